@@ -291,11 +291,15 @@ class DbCommands(object):
     @args('--overwrite', action='store_true',
           help='Drop and rewrite metadata. Needs to be combined with --merge '
                'option')
+    @args('--incremental', action='store_true',
+          help='Skip the files which have not changed since they were last '
+               'loaded with this option, as recorded in the metadefs '
+               'manifest.')
     def load_metadefs(self, path=None, merge=False,
-                      prefer_new=False, overwrite=False):
+                      prefer_new=False, overwrite=False, incremental=False):
         """Load metadefinition json files to database"""
         metadata.db_load_metadefs(db_api.get_engine(), path, merge,
-                                  prefer_new, overwrite)
+                                  prefer_new, overwrite, incremental)
 
     def unload_metadefs(self):
         """Unload metadefinitions from database"""
@@ -304,10 +308,14 @@ class DbCommands(object):
     @args('--path', metavar='<path>', help='Path to the directory where '
                                            'json metadata files should be '
                                            'saved.')
-    def export_metadefs(self, path=None):
+    @args('--archive', action='store_true',
+          help='Write all namespaces to a single gzipped tarball instead '
+               'of one file per namespace. If the path is a directory, '
+               'the tarball is written there as metadefs.tar.gz.')
+    def export_metadefs(self, path=None, archive=False):
         """Export metadefinitions data from database to files"""
         metadata.db_export_metadefs(db_api.get_engine(),
-                                    path)
+                                    path, archive)
 
     def _purge(self, age_in_days, max_rows, purge_images_only=False):
         try:
@@ -387,17 +395,19 @@ class DbLegacyCommands(object):
         self.command_object.check()
 
     def load_metadefs(self, path=None, merge=False,
-                      prefer_new=False, overwrite=False):
+                      prefer_new=False, overwrite=False, incremental=False):
         self.command_object.load_metadefs(CONF.command.path,
                                           CONF.command.merge,
                                           CONF.command.prefer_new,
-                                          CONF.command.overwrite)
+                                          CONF.command.overwrite,
+                                          CONF.command.incremental)
 
     def unload_metadefs(self):
         self.command_object.unload_metadefs()
 
-    def export_metadefs(self, path=None):
-        self.command_object.export_metadefs(CONF.command.path)
+    def export_metadefs(self, path=None, archive=False):
+        self.command_object.export_metadefs(CONF.command.path,
+                                            CONF.command.archive)
 
 
 def add_legacy_command_parsers(command_object, subparsers):
@@ -445,6 +455,7 @@ def add_legacy_command_parsers(command_object, subparsers):
     parser.add_argument('merge', nargs='?')
     parser.add_argument('prefer_new', nargs='?')
     parser.add_argument('overwrite', nargs='?')
+    parser.add_argument('incremental', nargs='?')
     parser.set_defaults(action='db_load_metadefs')
 
     parser = subparsers.add_parser('db_unload_metadefs')
@@ -454,6 +465,7 @@ def add_legacy_command_parsers(command_object, subparsers):
     parser = subparsers.add_parser('db_export_metadefs')
     parser.set_defaults(action_fn=legacy_command_object.export_metadefs)
     parser.add_argument('path', nargs='?')
+    parser.add_argument('archive', nargs='?')
     parser.set_defaults(action='db_export_metadefs')
 
 
@@ -19,6 +19,8 @@ except ImportError:
 from eventlet.green import socket
 
 import functools
+import ipaddress
+import mmap
 import os
 import re
 import urllib
@@ -53,33 +55,120 @@ IMAGE_META_HEADERS = ['x-image-meta-location', 'x-image-meta-size',
                       'x-image-meta-protected', 'x-image-meta-deleted',
                       'x-image-meta-virtual_size']
 
+_IMAGE_META_PREFIX = 'x-image-meta-'
+_IMAGE_META_PREFIX_LEN = len(_IMAGE_META_PREFIX)
+_IMAGE_META_PROPERTY_PREFIX = 'x-image-meta-property-'
+_IMAGE_META_PROPERTY_PREFIX_LEN = len(_IMAGE_META_PROPERTY_PREFIX)
+
+# NOTE: Precomputed lookup tables for the x-image-meta-* codec, so that
+# encoding and decoding headers costs a dict lookup per header instead of
+# string formatting and a linear scan of IMAGE_META_HEADERS.
+_IMAGE_META_FIELDS = frozenset(h[_IMAGE_META_PREFIX_LEN:]
+                               for h in IMAGE_META_HEADERS)
+_IMAGE_META_HEADER_TO_FIELD = {}
+for _field in _IMAGE_META_FIELDS:
+    _IMAGE_META_HEADER_TO_FIELD[_IMAGE_META_PREFIX + _field] = _field
+    _IMAGE_META_HEADER_TO_FIELD[
+        _IMAGE_META_PREFIX + _field.replace('_', '-')] = _field
+del _field
+_IMAGE_META_FIELD_TO_HEADER = dict((field, _IMAGE_META_PREFIX + field)
+                                   for field in _IMAGE_META_FIELDS)
+_IMAGE_META_INT_FIELDS = (('size', False), ('min_disk', False),
+                          ('min_ram', False), ('virtual_size', True))
+_IMAGE_META_BOOL_FIELDS = ('is_public', 'deleted', 'protected')
+
 TITICACA_TEST_SOCKET_FD_STR = 'TITICACA_TEST_SOCKET_FD'
 
 
-def chunkreadable(iter, chunk_size=65536):
+class ChunkSizePolicy(object):
+    """
+    Policy deciding the size of the reads done by chunkiter.
+
+    Reads start at initial_size, so the first bytes reach the consumer
+    quickly, and grow by growth_factor every time a read comes back full,
+    i.e. while the source keeps up with a large sequential stream, until
+    max_size is reached. A short read keeps the current size. When
+    block_size is given every size is a multiple of it, so reads line up
+    with a store's preferred block size.
+
+    The optional hook is called as hook(old_size, new_size) whenever the
+    policy changes the chunk size, which lets profiling code trace its
+    decisions.
+    """
+    def __init__(self, initial_size=8192, max_size=4194304, growth_factor=2,
+                 block_size=None, hook=None):
+        if initial_size < 1 or max_size < initial_size:
+            raise ValueError(_("Chunk sizes must satisfy "
+                               "0 < initial_size <= max_size"))
+        if growth_factor < 1:
+            raise ValueError(_("Chunk growth factor can't be lower than 1"))
+        if block_size is not None and block_size < 1:
+            raise ValueError(_("Block size must be a positive integer"))
+        self.growth_factor = growth_factor
+        self.block_size = block_size
+        self.hook = hook
+        if block_size and max_size >= block_size:
+            max_size -= max_size % block_size
+        self.max_size = max_size
+        self.initial_size = self._align(initial_size)
+
+    def _align(self, size):
+        if self.block_size:
+            remainder = size % self.block_size
+            if remainder:
+                size += self.block_size - remainder
+        return min(size, self.max_size)
+
+    def first_chunk_size(self):
+        """Return the size of the first read of a stream."""
+        return self.initial_size
+
+    def next_chunk_size(self, size, bytes_read):
+        """Return the size of the next read.
+
+        :param size: size requested by the previous read
+        :param bytes_read: number of bytes the previous read returned
+        """
+        if bytes_read < size or size >= self.max_size:
+            return size
+        new_size = self._align(int(size * self.growth_factor))
+        if new_size != size and self.hook is not None:
+            self.hook(size, new_size)
+        return new_size
+
+
+def chunkreadable(iter, chunk_size=65536, policy=None):
     """
     Wrap a readable iterator with a reader yielding chunks of
     a preferred size, otherwise leave iterator unchanged.
 
     :param iter: an iter which may also be readable
     :param chunk_size: maximum size of chunk
+    :param policy: optional ChunkSizePolicy overriding chunk_size
     """
-    return chunkiter(iter, chunk_size) if hasattr(iter, 'read') else iter
+    if hasattr(iter, 'read'):
+        return chunkiter(iter, chunk_size, policy=policy)
+    return iter
 
 
-def chunkiter(fp, chunk_size=65536):
+def chunkiter(fp, chunk_size=65536, policy=None):
     """
-    Return an iterator to a file-like obj which yields fixed size chunks
+    Return an iterator to a file-like obj which yields chunks of
+    chunk_size, or of the sizes decided by policy when one is given
 
     :param fp: a file-like object
     :param chunk_size: maximum size of chunk
+    :param policy: optional ChunkSizePolicy overriding chunk_size
     """
+    size = chunk_size if policy is None else policy.first_chunk_size()
     while True:
-        chunk = fp.read(chunk_size)
+        chunk = fp.read(size)
         if chunk:
             yield chunk
         else:
             break
+        if policy is not None:
+            size = policy.next_chunk_size(size, len(chunk))
 
 
 def cooperative_iter(iter):
@@ -119,51 +208,152 @@ CONF.import_group('import_filtering_opts',
                   'titicaca.async_.flows._internal_plugins')
 
 
-def validate_import_uri(uri):
-    """Validate requested uri for Image Import web-download.
+class _HostMatcher(object):
+    """Match hostnames against a configured list of host patterns.
 
-    :param uri: target uri to be validated
+    Plain entries are compared verbatim, entries of the form
+    ``*.example.com`` match any host ending in ``.example.com`` and
+    entries in CIDR notation match any IP address inside the network.
     """
-    if not uri:
+    def __init__(self, patterns):
+        self.names = set()
+        suffixes = []
+        self.networks = []
+        for pattern in patterns or []:
+            if pattern.startswith('*.'):
+                suffixes.append(pattern[1:].lower())
+                continue
+            if '/' in pattern:
+                try:
+                    self.networks.append(
+                        ipaddress.ip_network(pattern, strict=False))
+                    continue
+                except ValueError:
+                    pass
+            self.names.add(pattern)
+        self.suffixes = tuple(suffixes)
+
+    def __bool__(self):
+        return bool(self.names or self.suffixes or self.networks)
+
+    def __contains__(self, host):
+        if host in self.names:
+            return True
+        if self.suffixes and host.endswith(self.suffixes):
+            return True
+        if self.networks:
+            try:
+                address = ipaddress.ip_address(host)
+            except ValueError:
+                return False
+            return any(address in network for network in self.networks)
         return False
 
-    parsed_uri = urllib.parse.urlparse(uri)
-    scheme = parsed_uri.scheme
-    host = parsed_uri.hostname
-    port = parsed_uri.port
-    wl_schemes = CONF.import_filtering_opts.allowed_schemes
-    bl_schemes = CONF.import_filtering_opts.disallowed_schemes
-    wl_hosts = CONF.import_filtering_opts.allowed_hosts
-    bl_hosts = CONF.import_filtering_opts.disallowed_hosts
-    wl_ports = CONF.import_filtering_opts.allowed_ports
-    bl_ports = CONF.import_filtering_opts.disallowed_ports
-
-    # NOTE(jokke): Checking if both allowed and disallowed are defined and
-    # logging it to inform only allowed will be obeyed.
-    if wl_schemes and bl_schemes:
-        bl_schemes = []
-        LOG.debug("Both allowed and disallowed schemes has been configured. "
-                  "Will only process allowed list.")
-    if wl_hosts and bl_hosts:
-        bl_hosts = []
-        LOG.debug("Both allowed and disallowed hosts has been configured. "
-                  "Will only process allowed list.")
-    if wl_ports and bl_ports:
-        bl_ports = []
-        LOG.debug("Both allowed and disallowed ports has been configured. "
-                  "Will only process allowed list.")
-
-    if not scheme or ((wl_schemes and scheme not in wl_schemes) or
-                      parsed_uri.scheme in bl_schemes):
-        return False
-    if not host or ((wl_hosts and host not in wl_hosts) or
-                    host in bl_hosts):
-        return False
-    if port and ((wl_ports and port not in wl_ports) or
-                 port in bl_ports):
-        return False
 
-    return True
+class ImportURIPolicy(object):
+    """Compiled allow/deny policy for Image Import web-download uris.
+
+    The ``import_filtering_opts`` lists are turned into sets and host
+    matchers once, so that validating a uri does not need to touch the
+    configuration object at all.
+    """
+    def __init__(self, allowed_schemes=None, disallowed_schemes=None,
+                 allowed_hosts=None, disallowed_hosts=None,
+                 allowed_ports=None, disallowed_ports=None):
+        # NOTE(jokke): Checking if both allowed and disallowed are defined
+        # and logging it to inform only allowed will be obeyed.
+        if allowed_schemes and disallowed_schemes:
+            disallowed_schemes = []
+            LOG.debug("Both allowed and disallowed schemes has been "
+                      "configured. Will only process allowed list.")
+        if allowed_hosts and disallowed_hosts:
+            disallowed_hosts = []
+            LOG.debug("Both allowed and disallowed hosts has been "
+                      "configured. Will only process allowed list.")
+        if allowed_ports and disallowed_ports:
+            disallowed_ports = []
+            LOG.debug("Both allowed and disallowed ports has been "
+                      "configured. Will only process allowed list.")
+
+        self.allowed_schemes = frozenset(allowed_schemes or [])
+        self.disallowed_schemes = frozenset(disallowed_schemes or [])
+        self.allowed_hosts = _HostMatcher(allowed_hosts)
+        self.disallowed_hosts = _HostMatcher(disallowed_hosts)
+        self.allowed_ports = frozenset(allowed_ports or [])
+        self.disallowed_ports = frozenset(disallowed_ports or [])
+
+    @classmethod
+    def from_conf(cls, conf=None):
+        opts = (conf or CONF).import_filtering_opts
+        return cls(allowed_schemes=opts.allowed_schemes,
+                   disallowed_schemes=opts.disallowed_schemes,
+                   allowed_hosts=opts.allowed_hosts,
+                   disallowed_hosts=opts.disallowed_hosts,
+                   allowed_ports=opts.allowed_ports,
+                   disallowed_ports=opts.disallowed_ports)
+
+    def is_allowed(self, uri):
+        """Return True if the uri passes the scheme, host and port rules.
+
+        :param uri: target uri to be validated
+        """
+        if not uri:
+            return False
+
+        parsed_uri = urllib.parse.urlparse(uri)
+        scheme = parsed_uri.scheme
+        host = parsed_uri.hostname
+        port = parsed_uri.port
+
+        if not scheme or ((self.allowed_schemes and
+                           scheme not in self.allowed_schemes) or
+                          scheme in self.disallowed_schemes):
+            return False
+        if not host or ((self.allowed_hosts and
+                         host not in self.allowed_hosts) or
+                        host in self.disallowed_hosts):
+            return False
+        if port and ((self.allowed_ports and
+                      port not in self.allowed_ports) or
+                     port in self.disallowed_ports):
+            return False
+
+        return True
+
+
+_IMPORT_URI_POLICY = None
+
+
+def get_import_uri_policy():
+    """Return the compiled import uri policy, building it on first use."""
+    global _IMPORT_URI_POLICY
+    policy = _IMPORT_URI_POLICY
+    if policy is None:
+        policy = _IMPORT_URI_POLICY = ImportURIPolicy.from_conf()
+    return policy
+
+
+def reset_import_uri_policy(*args, **kwargs):
+    """Drop the compiled import uri policy so it is rebuilt from CONF.
+
+    Registered as a config mutate hook, so that reloading the
+    configuration (SIGHUP) picks up new ``import_filtering_opts`` values.
+    Options changed without a reload, like set_override() in tests, need
+    an explicit call.
+    """
+    global _IMPORT_URI_POLICY
+    _IMPORT_URI_POLICY = None
+
+
+CONF.register_mutate_hook(reset_import_uri_policy)
+
+
+def validate_import_uri(uri):
+    """Validate requested uri for Image Import web-download.
+
+    :param uri: target uri to be validated
+    """
+    return get_import_uri_policy().is_allowed(uri)
 
 
 class CooperativeReader(object):
@@ -287,6 +477,147 @@ class LimitingReader(object):
         return result
 
 
+MMAP_WINDOW_SIZE = 67108864  # 64M of address space mapped at a time
+
+
+class MappedFileReader(object):
+    """
+    Reader for locally staged image files backed by a read-only mmap.
+
+    Data is handed out as memoryview slices of the mapping, so consumers
+    accepting any bytes-like object (hashers, store drivers) get page
+    cache hits instead of a read() syscall and a copy per chunk. The file
+    is mapped in windows of at most window_size bytes, each advised for
+    sequential access, so huge images do not pin huge mappings.
+
+    Slices handed out stay valid after the reader has moved on to the
+    next window or has been closed; the mapping is only torn down once
+    the last slice is released.
+    """
+    def __init__(self, path, chunk_size=65536, window_size=MMAP_WINDOW_SIZE):
+        """
+        :param path: path of the local file to read
+        :param chunk_size: size of the chunks yielded when iterating
+        :param window_size: maximum number of bytes mapped at a time
+        """
+        granularity = mmap.ALLOCATIONGRANULARITY
+        self.path = path
+        self.chunk_size = chunk_size
+        self.window_size = max(granularity,
+                               window_size - window_size % granularity)
+        self.position = 0
+        self._map = None
+        self._view = None
+        self._window_start = 0
+        self._window_end = 0
+        self._fd = os.open(path, os.O_RDONLY)
+        try:
+            self.size = os.fstat(self._fd).st_size
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                os.close(self._fd)
+
+    def _release_window(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # NOTE: slices of this window are still referenced by a
+                # consumer; the mapping goes away with the last of them.
+                pass
+            self._map = None
+        self._window_start = self._window_end = 0
+
+    def _map_window(self):
+        self._release_window()
+        start = self.position - self.position % self.window_size
+        length = min(self.window_size, self.size - start)
+        mapped = mmap.mmap(self._fd, length, access=mmap.ACCESS_READ,
+                           offset=start)
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        self._map = mapped
+        self._view = memoryview(mapped)
+        self._window_start = start
+        self._window_end = start + length
+
+    def _next_slice(self, length):
+        """Return up to length bytes without crossing a window boundary."""
+        if self.position >= self.size:
+            return b''
+        if not self._window_start <= self.position < self._window_end:
+            self._map_window()
+        offset = self.position - self._window_start
+        end = min(offset + length, self._window_end - self._window_start)
+        self.position += end - offset
+        return self._view[offset:end]
+
+    def read(self, length=None):
+        """Return up to length bytes as a memoryview of the mapping.
+
+        A read spanning two windows is returned as a bytes copy, which
+        happens at most once per window.
+        """
+        if self._fd is None:
+            raise ValueError(_("I/O operation on closed file"))
+        if length is None or length < 0:
+            length = self.size - self.position
+        data = self._next_slice(length)
+        if len(data) == length or self.position >= self.size:
+            return data
+        result = bytearray(data)
+        while len(result) < length and self.position < self.size:
+            result.extend(self._next_slice(length - len(result)))
+        return bytes(result)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(_("Negative seek position %d") % offset)
+        self.position = offset
+        return self.position
+
+    def close(self):
+        self._release_window()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_staged_image_reader(uri, chunk_size=65536):
+    """
+    Return a MappedFileReader for an image staged on the local node
+
+    :param uri: file:// uri of the staged image, e.g. built from
+                node_staging_uri or work_dir
+    :param chunk_size: size of the chunks yielded when iterating
+    """
+    path = uri[len('file://'):] if uri.startswith('file://') else uri
+    return MappedFileReader(path, chunk_size=chunk_size)
+
+
 def image_meta_to_http_headers(image_meta):
     """
     Returns a set of image metadata into a dict
@@ -296,15 +627,19 @@ def image_meta_to_http_headers(image_meta):
     :param image_meta: Mapping of image metadata
     """
     headers = {}
+    header_names = _IMAGE_META_FIELD_TO_HEADER
     for k, v in image_meta.items():
-        if v is not None:
-            if k == 'properties':
-                for pk, pv in v.items():
-                    if pv is not None:
-                        headers["x-image-meta-property-%s"
-                                % pk.lower()] = str(pv)
-            else:
-                headers["x-image-meta-%s" % k.lower()] = str(v)
+        if v is None:
+            continue
+        if k == 'properties':
+            for pk, pv in v.items():
+                if pv is not None:
+                    headers[_IMAGE_META_PROPERTY_PREFIX + pk.lower()] = str(pv)
+        else:
+            header = header_names.get(k)
+            if header is None:
+                header = _IMAGE_META_PREFIX + k.lower()
+            headers[header] = str(v)
     return headers
 
 
@@ -324,21 +659,26 @@ def get_image_meta_from_headers(response):
     else:  # webob.Response
         headers = response.headers.items()
 
+    known_headers = _IMAGE_META_HEADER_TO_FIELD
     for key, value in headers:
         key = str(key.lower())
-        if key.startswith('x-image-meta-property-'):
-            field_name = key[len('x-image-meta-property-'):].replace('-', '_')
-            properties[field_name] = value or None
-        elif key.startswith('x-image-meta-'):
-            field_name = key[len('x-image-meta-'):].replace('-', '_')
-            if 'x-image-meta-' + field_name not in IMAGE_META_HEADERS:
+        field_name = known_headers.get(key)
+        if field_name is not None:
+            result[field_name] = value or None
+        elif key.startswith(_IMAGE_META_PROPERTY_PREFIX):
+            field_name = key[_IMAGE_META_PROPERTY_PREFIX_LEN:]
+            properties[field_name.replace('-', '_')] = value or None
+        elif key.startswith(_IMAGE_META_PREFIX):
+            # NOTE: Known fields spelled with any mix of '-' and '_' that
+            # the lookup table does not cover still have to be accepted.
+            field_name = key[_IMAGE_META_PREFIX_LEN:].replace('-', '_')
+            if field_name not in _IMAGE_META_FIELDS:
                 msg = _("Bad header: %(header_name)s") % {'header_name': key}
                 raise exc.HTTPBadRequest(msg, content_type="text/plain")
             result[field_name] = value or None
     result['properties'] = properties
 
-    for key, nullable in [('size', False), ('min_disk', False),
-                          ('min_ram', False), ('virtual_size', True)]:
+    for key, nullable in _IMAGE_META_INT_FIELDS:
         if key in result:
             try:
                 result[key] = int(result[key])
@@ -358,7 +698,7 @@ def get_image_meta_from_headers(response):
                                                       param=key,
                                                       extra_msg=extra)
 
-    for key in ('is_public', 'deleted', 'protected'):
+    for key in _IMAGE_META_BOOL_FIELDS:
         if key in result:
             result[key] = strutils.bool_from_string(result[key])
     return result
@@ -495,43 +835,87 @@ except re.error:
     REGEX_4BYTE_UNICODE = re.compile(u'[\uD800-\uDBFF][\uDC00-\uDFFF]')
 
 
+def _has_4byte_unicode(value):
+    # NOTE: ASCII strings are by far the common case and can never hold
+    # a 4 byte character, so skip the regex for them entirely.
+    return (isinstance(value, str) and not value.isascii() and
+            REGEX_4BYTE_UNICODE.search(value) is not None)
+
+
+def find_4byte_unicode(data):
+    """
+    Walk a dict (and the dicts nested in it) looking for 4 byte unicode
+
+    The walk is iterative, so deeply nested dicts cannot exhaust the
+    stack, and it stops at the first offending string.
+
+    :param data: dict to check
+    :returns: None if data is clean, otherwise a tuple (path, is_key)
+              where path is the tuple of keys leading to the offending
+              string and is_key tells whether the key itself or its
+              value holds the 4 byte characters
+    """
+    stack = [(iter(data.items()), ())]
+    while stack:
+        items, path = stack[-1]
+        for key, value in items:
+            if isinstance(value, dict):
+                stack.append((iter(value.items()), path + (key,)))
+                break
+            if _has_4byte_unicode(key):
+                return path + (key,), True
+            if _has_4byte_unicode(value):
+                return path + (key,), False
+        else:
+            stack.pop()
+    return None
+
+
+def _raise_4byte_error(path, is_key):
+    key_path = '.'.join(map(str, path))
+    LOG.debug("4 byte unicode found in %s", key_path)
+    if is_key:
+        msg = (_("Property names can't contain 4 byte unicode: %s.")
+               % key_path)
+    else:
+        msg = (_("%(name)s can't contain 4 byte unicode characters: "
+                 "%(path)s.") % {'name': str(path[-1]).title(),
+                                 'path': key_path})
+    raise exception.Invalid(msg)
+
+
+def check_no_4byte_values(values_list):
+    """
+    Batch validator ensuring no dict in values_list holds 4 byte unicode
+
+    Meant for bulk inserts, where every row has to be validated before
+    anything is written.
+
+    :param values_list: iterable of dicts to check
+    :raises titicaca.common.exception.Invalid: on the first offending row
+    """
+    for values in values_list:
+        found = find_4byte_unicode(values)
+        if found is not None:
+            _raise_4byte_error(*found)
+
+
 def no_4byte_params(f):
     """
     Checks that no 4 byte unicode characters are allowed
     in dicts' keys/values and string's parameters
     """
+    @functools.wraps(f)
     def wrapper(*args, **kwargs):
-
-        def _is_match(some_str):
-            return (
-                isinstance(some_str, str) and
-                REGEX_4BYTE_UNICODE.findall(some_str) != []
-            )
-
-        def _check_dict(data_dict):
-            # a dict of dicts has to be checked recursively
-            for key, value in data_dict.items():
-                if isinstance(value, dict):
-                    _check_dict(value)
-                else:
-                    if _is_match(key):
-                        msg = _("Property names can't contain 4 byte unicode.")
-                        raise exception.Invalid(msg)
-                    if _is_match(value):
-                        msg = (_("%s can't contain 4 byte unicode characters.")
-                               % key.title())
-                        raise exception.Invalid(msg)
-
-        for data_dict in [arg for arg in args if isinstance(arg, dict)]:
-            _check_dict(data_dict)
+        check_no_4byte_values(arg for arg in args if isinstance(arg, dict))
         # now check args for str values
         for arg in args:
-            if _is_match(arg):
+            if _has_4byte_unicode(arg):
                 msg = _("Param values can't contain 4 byte unicode.")
                 raise exception.Invalid(msg)
         # check kwargs as well, as params are passed as kwargs via
         # registry calls
-        _check_dict(kwargs)
+        check_no_4byte_values((kwargs,))
         return f(*args, **kwargs)
     return wrapper
 
@@ -940,6 +940,25 @@ def metadef_tag_count(context, namespace_name):
     return count
 
 
+@log_call
+def metadef_namespace_count_content(context, namespace_ids):
+    """Get object, property, tag and resource type counts of namespaces"""
+    counts = dict((namespace_id, {'objects': 0, 'properties': 0,
+                                  'tags': 0, 'resource_types': 0})
+                  for namespace_id in namespace_ids)
+
+    for key, table in (('objects', 'metadef_objects'),
+                       ('properties', 'metadef_properties'),
+                       ('tags', 'metadef_tags'),
+                       ('resource_types',
+                        'metadef_namespace_resource_types')):
+        for record in DATA[table]:
+            if record['namespace_id'] in counts:
+                counts[record['namespace_id']][key] += 1
+
+    return counts
+
+
 def _format_association(namespace, resource_type, association_values):
     association = {
         'namespace_id': namespace['id'],
@@ -12,24 +12,71 @@
 """Defines interface for DB access."""
 
 import threading
+import time
 
 import osprofiler.sqlalchemy
 import sqlalchemy
 from oslo_config import cfg
+from oslo_db import exception as db_exception
 from oslo_db.sqlalchemy import session
 from oslo_log import log as logging
 
+from titicaca.db.sqlalchemy import query_stats
+from titicaca.i18n import _
+
 sa_logger = None
 LOG = logging.getLogger(__name__)
 
 STATUSES = ['active', 'saving', 'queued', 'killed', 'pending_delete',
             'deleted', 'deactivated', 'importing', 'uploading']
 
+db_opts = [
+    cfg.BoolOpt('use_read_replica',
+                default=False,
+                help=_("""
+Route read-only database work to the read replica.
+
+When enabled, lookups and listings run through ``run_reader`` use the
+database configured by ``[database]/slave_connection`` instead of the
+primary. Replicas may lag behind the primary, so callers that must see
+their own writes ask for the primary explicitly. If the replica can't be
+reached, reads fall back to the primary.
+
+Possible values:
+    * True
+    * False
+
+Related options:
+    * [database]/slave_connection
+    * read_replica_retry_interval
+
+""")),
+    cfg.IntOpt('read_replica_retry_interval',
+               default=30,
+               min=0,
+               help=_("""
+Time in seconds reads stay on the primary after the replica failed.
+
+When a read on the replica fails with a connection error it is retried
+on the primary, and the replica is left alone for this many seconds
+before it is tried again.
+
+Possible values:
+    * Zero or positive integer
+
+Related options:
+    * use_read_replica
+
+""")),
+]
+
 CONF = cfg.CONF
+CONF.register_opts(db_opts)
 CONF.import_group("profiler", "titicaca.common.wsgi")
 
 _FACADE = None
 _LOCK = threading.Lock()
+_REPLICA_RETRY_AT = 0
 
 
 def _create_facade_lazily():
@@ -39,6 +86,10 @@ def _create_facade_lazily():
             if _FACADE is None:
                 _FACADE = session.EngineFacade.from_config(CONF)
 
+                query_stats.install(_FACADE.get_engine())
+                if CONF.database.slave_connection:
+                    query_stats.install(_FACADE.get_engine(use_slave=True))
+
                 if CONF.profiler.enabled and CONF.profiler.trace_sqlalchemy:
                     osprofiler.sqlalchemy.add_tracing(sqlalchemy,
                                                       _FACADE.get_engine(),
@@ -46,20 +97,55 @@ def _create_facade_lazily():
     return _FACADE
 
 
-def get_engine():
+def get_engine(use_slave=False):
     facade = _create_facade_lazily()
-    return facade.get_engine()
+    return facade.get_engine(use_slave=use_slave)
 
 
-def get_session(autocommit=True, expire_on_commit=False):
+def get_session(autocommit=True, expire_on_commit=False, use_slave=False):
     facade = _create_facade_lazily()
     return facade.get_session(autocommit=autocommit,
-                              expire_on_commit=expire_on_commit)
+                              expire_on_commit=expire_on_commit,
+                              use_slave=use_slave)
+
+
+def _replica_available():
+    return (CONF.use_read_replica and
+            CONF.database.slave_connection and
+            time.monotonic() >= _REPLICA_RETRY_AT)
+
+
+def _mark_replica_failed():
+    global _REPLICA_RETRY_AT
+    _REPLICA_RETRY_AT = time.monotonic() + CONF.read_replica_retry_interval
+
+
+def run_reader(func, *args, allow_stale=True, **kwargs):
+    """Run a read-only DB API call, on the read replica if possible.
+
+    func is called with a session keyword argument on top of the given
+    arguments, e.g. run_reader(metadef_api.namespace.get_all, context).
+
+    :param allow_stale: whether the caller can live with data lagging
+                        behind the primary; when False the primary is
+                        always used
+    """
+    if not (allow_stale and _replica_available()):
+        return func(*args, session=get_session(), **kwargs)
+
+    try:
+        return func(*args, session=get_session(use_slave=True), **kwargs)
+    except db_exception.DBConnectionError as e:
+        LOG.warning("Read replica unavailable, retrying on the primary "
+                    "database: %s", e)
+        _mark_replica_failed()
+        return func(*args, session=get_session(), **kwargs)
 
 
 def clear_db_env():
     """
     Unset global configuration variables for database.
     """
-    global _FACADE
+    global _FACADE, _REPLICA_RETRY_AT
     _FACADE = None
+    _REPLICA_RETRY_AT = 0
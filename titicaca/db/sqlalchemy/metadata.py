@@ -7,17 +7,24 @@
 # Copyright (c) 2023 WenRui Gong
 # All rights reserved.
 
+import collections
+from concurrent import futures
+import hashlib
+import io
 import json
 import os
 from os.path import isfile
 from os.path import join
 import re
+import tarfile
+import time
 
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import encodeutils
 import sqlalchemy
 from sqlalchemy import and_
+from sqlalchemy import bindparam
 from sqlalchemy.schema import MetaData
 from sqlalchemy.sql import select
 
@@ -50,118 +57,88 @@ Related options:
     * None
 
 """)),
-]
-
-CONF = cfg.CONF
-CONF.register_opts(metadata_opts)
-
-
-
-def get_metadef_namespaces_table(meta):
-    engine = db_api.get_engine()
-    return sqlalchemy.Table('metadef_namespaces', meta, autoload_with=engine)
+    cfg.IntOpt('metadata_load_workers',
+               default=4,
+               min=1,
+               help=_("""
+Number of workers used to load and export metadefs files.
 
+The JSON metadefs files are read, parsed and checked by this many
+threads before anything is written, so that all the broken files are
+reported at once. Namespaces are then written to the database by this
+many threads as well, except on SQLite, which is written sequentially.
+Exported namespaces are written to their files by this many threads.
 
-def get_metadef_resource_types_table(meta):
-    engine = db_api.get_engine()
-    return sqlalchemy.Table('metadef_resource_types', meta, autoload_with=engine)
+Possible values:
+    * Positive integer
 
+Related options:
+    * metadata_source_path
 
-def get_metadef_namespace_resource_types_table(meta):
-    engine = db_api.get_engine()
-    return sqlalchemy.Table('metadef_namespace_resource_types', meta,
-                            autoload_with=engine)
+""")),
+    cfg.StrOpt('metadata_manifest_path',
+               help=_("""
+Path of the manifest of incrementally loaded metadefs files.
 
+``titicaca-manage db load_metadefs --incremental`` records the SHA-256
+of every file it loads, and the namespace it holds, in this JSON file.
+Later incremental loads skip the files whose content hasn't changed
+since, as long as their namespace is still in the database. When unset,
+the manifest is kept as .metadefs-manifest.json in the directory the
+files are loaded from.
 
-def get_metadef_properties_table(meta):
-    engine = db_api.get_engine()
-    return sqlalchemy.Table('metadef_properties', meta, autoload_with=engine)
+Possible values:
+    * String value representing a valid absolute pathname
 
+Related options:
+    * metadata_source_path
 
-def get_metadef_objects_table(meta):
-    engine = db_api.get_engine()
-    return sqlalchemy.Table('metadef_objects', meta, autoload_with=engine)
+""")),
+]
 
+CONF = cfg.CONF
+CONF.register_opts(metadata_opts)
 
-def get_metadef_tags_table(meta):
-    engine = db_api.get_engine()
-    return sqlalchemy.Table('metadef_tags', meta, autoload_with=engine)
 
+def _get_table(meta, name):
+    """Return the table called name, reflected once per MetaData.
 
-def _get_resource_type_id(meta, name):
-    rt_table = get_metadef_resource_types_table(meta)
-    resource_type = (
-        select([rt_table.c.id]).
-        where(rt_table.c.name == name).
-        select_from(rt_table).
-        execute().fetchone())
-    if resource_type:
-        return resource_type[0]
-    return None
+    The load, unload and export helpers ask for the same few tables for
+    every namespace, resource type and row they handle, so the reflected
+    tables are looked up in meta.tables before going to the DB catalog.
+    """
+    table = meta.tables.get(name)
+    if table is None:
+        table = sqlalchemy.Table(name, meta, autoload_with=_get_engine(meta))
+    return table
 
 
-def _get_resource_type(meta, resource_type_id):
-    rt_table = get_metadef_resource_types_table(meta)
-    return (
-        rt_table.select().
-        where(rt_table.c.id == resource_type_id).
-        execute().fetchone())
+def _get_engine(meta):
+    return getattr(meta, 'bind', None) or db_api.get_engine()
 
 
-def _get_namespace_resource_types(meta, namespace_id):
-    namespace_resource_types_table = (
-        get_metadef_namespace_resource_types_table(meta))
-    return (
-        namespace_resource_types_table.select().
-        where(namespace_resource_types_table.c.namespace_id == namespace_id).
-        execute().fetchall())
+def get_metadef_namespaces_table(meta):
+    return _get_table(meta, 'metadef_namespaces')
 
 
-def _get_namespace_resource_type_by_ids(meta, namespace_id, rt_id):
-    namespace_resource_types_table = (
-        get_metadef_namespace_resource_types_table(meta))
-    return (
-        namespace_resource_types_table.select().
-        where(and_(
-            namespace_resource_types_table.c.namespace_id == namespace_id,
-            namespace_resource_types_table.c.resource_type_id == rt_id)).
-        execute().fetchone())
+def get_metadef_resource_types_table(meta):
+    return _get_table(meta, 'metadef_resource_types')
 
 
-def _get_properties(meta, namespace_id):
-    properties_table = get_metadef_properties_table(meta)
-    return (
-        properties_table.select().
-        where(properties_table.c.namespace_id == namespace_id).
-        execute().fetchall())
+def get_metadef_namespace_resource_types_table(meta):
+    return _get_table(meta, 'metadef_namespace_resource_types')
 
 
-def _get_objects(meta, namespace_id):
-    objects_table = get_metadef_objects_table(meta)
-    return (
-        objects_table.select().
-        where(objects_table.c.namespace_id == namespace_id).
-        execute().fetchall())
+def get_metadef_properties_table(meta):
+    return _get_table(meta, 'metadef_properties')
 
 
-def _get_tags(meta, namespace_id):
-    tags_table = get_metadef_tags_table(meta)
-    return (
-        tags_table.select().
-        where(tags_table.c.namespace_id == namespace_id).
-        execute().fetchall())
+def get_metadef_objects_table(meta):
+    return _get_table(meta, 'metadef_objects')
 
 
-def _get_resource_id(table, namespace_id, resource_name):
-    resource = (
-        select([table.c.id]).
-        where(and_(table.c.namespace_id == namespace_id,
-                   table.c.name == resource_name)).
-        select_from(table).
-        execute().fetchone())
-    if resource:
-        return resource[0]
-    return None
+def get_metadef_tags_table(meta):
+    return _get_table(meta, 'metadef_tags')
 
 
 def _clear_metadata(meta):
@@ -172,12 +149,13 @@ def _clear_metadata(meta):
                       get_metadef_namespaces_table(meta),
                       get_metadef_resource_types_table(meta)]
 
-    for table in metadef_tables:
-        table.delete().execute()
-        LOG.info("Table %s has been cleared", table)
+    with _get_engine(meta).begin() as conn:
+        for table in metadef_tables:
+            conn.execute(table.delete())
+            LOG.info("Table %s has been cleared", table)
 
 
-def _clear_namespace_metadata(meta, namespace_id):
+def _clear_namespace_metadata(conn, meta, namespace_id):
     metadef_tables = [get_metadef_properties_table(meta),
                       get_metadef_objects_table(meta),
                       get_metadef_tags_table(meta),
@@ -185,13 +163,341 @@ def _clear_namespace_metadata(meta, namespace_id):
     namespaces_table = get_metadef_namespaces_table(meta)
 
     for table in metadef_tables:
-        table.delete().where(table.c.namespace_id == namespace_id).execute()
-    namespaces_table.delete().where(
-        namespaces_table.c.id == namespace_id).execute()
+        conn.execute(
+            table.delete().where(table.c.namespace_id == namespace_id))
+    conn.execute(namespaces_table.delete().where(
+        namespaces_table.c.id == namespace_id))
+
+
+def _unique_by(key, records):
+    """Drop the records repeating the key of an earlier one, with a warning.
+
+    Such duplicates used to fail on insert one by one; a bulk insert
+    would fail as a whole.
+    """
+    seen = set()
+    unique = []
+    for record in records:
+        if record[key] in seen:
+            LOG.warning("Duplicate entry for values: %s", record)
+            continue
+        seen.add(record[key])
+        unique.append(record)
+    return unique
+
+
+def _apply_records(conn, table, namespace_id, records, prefer_new):
+    """Insert the new records of a namespace, update existing ones.
+
+    The names already in the namespace are fetched with one query; the
+    records with other names are inserted and, with prefer_new, the
+    others updated, each with a single executemany.
+    """
+    records = _unique_by('name', records)
+    existing = dict(conn.execute(
+        select(table.c.name, table.c.id).where(
+            table.c.namespace_id == namespace_id)).fetchall())
+
+    now = timeutils.utcnow()
+    inserts = [dict(record, created_at=now) for record in records
+               if record['name'] not in existing]
+    if inserts:
+        conn.execute(table.insert(), inserts)
+
+    if prefer_new:
+        # NOTE: bind parameters can't be named after the columns they set
+        updates = []
+        for record in records:
+            if record['name'] in existing:
+                update = {'b_' + key: value for key, value in record.items()}
+                update.update(b_id=existing[record['name']],
+                              b_updated_at=now)
+                updates.append(update)
+        if updates:
+            columns = [key for key in records[0]] + ['updated_at']
+            conn.execute(
+                table.update().where(table.c.id == bindparam('b_id')).values(
+                    {key: bindparam('b_' + key) for key in columns}),
+                updates)
+
+
+def _ensure_resource_types(conn, meta, names, prefer_new):
+    """Create the resource types of names that don't exist yet.
+
+    With prefer_new, the existing ones are marked as updated.
+
+    :returns: dict of the resource type ids by name
+    """
+    resource_types_table = get_metadef_resource_types_table(meta)
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+
+    now = timeutils.utcnow()
+
+    def _get_resource_type_ids():
+        return dict(conn.execute(
+            select(resource_types_table.c.name,
+                   resource_types_table.c.id).where(
+                resource_types_table.c.name.in_(names))).fetchall())
+
+    rt_ids = _get_resource_type_ids()
+    if prefer_new and rt_ids:
+        conn.execute(resource_types_table.update().where(
+            resource_types_table.c.id.in_(list(rt_ids.values()))).values(
+                updated_at=now))
+    missing = [name for name in names if name not in rt_ids]
+    if missing:
+        conn.execute(resource_types_table.insert(),
+                     [{'name': name, 'created_at': now, 'protected': True}
+                      for name in missing])
+        rt_ids = _get_resource_type_ids()
+    return rt_ids
+
+
+def _apply_resource_type_associations(conn, meta, namespace_id,
+                                      associations, prefer_new):
+    """(Re)associate the namespace with its resource types.
+
+    The resource types are expected to exist already, see
+    _ensure_resource_types; any missing one is created.
+    """
+    namespace_rt_table = get_metadef_namespace_resource_types_table(meta)
+    associations = _unique_by('name', associations)
+    if not associations:
+        return
+
+    now = timeutils.utcnow()
+    rt_ids = _ensure_resource_types(
+        conn, meta, [association['name'] for association in associations],
+        False)
+
+    associated = set(conn.execute(
+        select(namespace_rt_table.c.resource_type_id).where(
+            namespace_rt_table.c.namespace_id == namespace_id)).scalars())
+
+    inserts = []
+    updates = []
+    for association in associations:
+        values = {
+            'namespace_id': namespace_id,
+            'resource_type_id': rt_ids[association['name']],
+            'properties_target': association.get('properties_target'),
+            'prefix': association.get('prefix'),
+        }
+        if values['resource_type_id'] not in associated:
+            inserts.append(dict(values, created_at=now))
+        elif prefer_new:
+            updates.append({
+                'b_rt_id': values['resource_type_id'],
+                'b_properties_target': values['properties_target'],
+                'b_prefix': values['prefix'],
+                'b_updated_at': now})
+
+    if inserts:
+        conn.execute(namespace_rt_table.insert(), inserts)
+    if updates:
+        conn.execute(
+            namespace_rt_table.update().where(and_(
+                namespace_rt_table.c.namespace_id == namespace_id,
+                namespace_rt_table.c.resource_type_id ==
+                bindparam('b_rt_id'))).values(
+                    properties_target=bindparam('b_properties_target'),
+                    prefix=bindparam('b_prefix'),
+                    updated_at=bindparam('b_updated_at')),
+            updates)
+
+
+def _normalize_metadef(metadata):
+    """Check the structure of a parsed metadefs file and normalize it.
+
+    :returns: dict of the namespace values and the lists of resource type
+              associations, properties, objects and tags to write, with
+              the JSON schemas already serialized
+    :raises ValueError: if the document isn't a valid metadefs file
+    """
+    if not isinstance(metadata, dict):
+        raise ValueError(_("expected a JSON object"))
+    if not metadata.get('namespace') or not isinstance(
+            metadata['namespace'], str):
+        raise ValueError(_("'namespace' must be a non empty string"))
+
+    def _named_list(key):
+        items = metadata.get(key, [])
+        if not isinstance(items, list):
+            raise ValueError(_("'%s' must be a list") % key)
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(
+                    item.get('name'), str):
+                raise ValueError(_("every item of '%s' must be an object "
+                                   "with a string 'name'") % key)
+        return items
+
+    properties = metadata.get('properties', {})
+    if not isinstance(properties, dict):
+        raise ValueError(_("'properties' must be an object"))
+
+    return {
+        'namespace': {
+            'namespace': metadata['namespace'],
+            'display_name': metadata.get('display_name'),
+            'description': metadata.get('description'),
+            'visibility': metadata.get('visibility'),
+            'protected': metadata.get('protected'),
+            'owner': metadata.get('owner', 'admin'),
+        },
+        'resource_type_associations': [
+            {'name': association['name'],
+             'properties_target': association.get('properties_target'),
+             'prefix': association.get('prefix')}
+            for association in _named_list('resource_type_associations')],
+        'properties': [
+            {'name': name, 'json_schema': json.dumps(schema)}
+            for name, schema in properties.items()],
+        'objects': [
+            {'name': md_object['name'],
+             'description': md_object.get('description'),
+             'json_schema': json.dumps(md_object.get('properties'))}
+            for md_object in _named_list('objects')],
+        'tags': [{'name': tag['name']} for tag in _named_list('tags')],
+    }
+
+
+def _read_metadef_file(file, known_digest=None):
+    """Parse and normalize a metadefs file.
+
+    :param known_digest: SHA-256 of the file when it was last loaded; if
+                         the content still matches it the file isn't
+                         parsed at all
+    :returns: tuple of the normalized record, or None if the file is
+              unchanged or broken, the error message, or None, and the
+              SHA-256 hex digest of the content
+    """
+    try:
+        with open(file, 'rb') as json_file:
+            content = json_file.read()
+    except Exception as e:
+        return None, encodeutils.exception_to_unicode(e), None
+
+    digest = hashlib.sha256(content).hexdigest()
+    if digest == known_digest:
+        return None, None, digest
+    try:
+        return _normalize_metadef(json.loads(content)), None, digest
+    except Exception as e:
+        return None, encodeutils.exception_to_unicode(e), digest
+
+
+def _get_manifest_path(metadata_path):
+    if CONF.metadata_manifest_path:
+        return CONF.metadata_manifest_path
+    if isfile(metadata_path):
+        metadata_path = os.path.dirname(metadata_path)
+    return join(metadata_path, '.metadefs-manifest.json')
+
+
+def _read_manifest(manifest_path):
+    """Return the file entries of the manifest, empty if there is none"""
+    try:
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file).get('files', {})
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        LOG.warning("Ignoring unreadable metadefs manifest %(path)s: "
+                    "%(error_msg)s",
+                    {'path': manifest_path,
+                     'error_msg': encodeutils.exception_to_unicode(e)})
+        return {}
+
+
+def _write_manifest(manifest_path, entries):
+    tmp_path = manifest_path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump({'version': 1, 'files': entries}, manifest_file,
+                      indent=2, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
+    except OSError as e:
+        LOG.error("Failed to write metadefs manifest %(path)s: "
+                  "%(error_msg)s",
+                  {'path': manifest_path,
+                   'error_msg': encodeutils.exception_to_unicode(e)})
+
+
+def _load_namespace(conn, meta, record, merge, prefer_new, overwrite):
+    """Load a normalized metadefs file record, return False if skipped."""
+    namespaces_table = get_metadef_namespaces_table(meta)
+    values = dict(record['namespace'])
+
+    namespace_id = conn.execute(
+        select(namespaces_table.c.id).where(
+            namespaces_table.c.namespace == values['namespace'])
+    ).scalar()
+
+    if namespace_id is not None and overwrite:
+        LOG.info("Overwriting namespace %s", values['namespace'])
+        _clear_namespace_metadata(conn, meta, namespace_id)
+        namespace_id = None
+
+    if namespace_id is None:
+        values.update({'created_at': timeutils.utcnow()})
+        namespace_id = conn.execute(
+            namespaces_table.insert().values(values)
+        ).inserted_primary_key[0]
+    elif not merge:
+        LOG.info("Skipping namespace %s. It already exists in the "
+                 "database.", values['namespace'])
+        return False
+    elif prefer_new:
+        values.update({'updated_at': timeutils.utcnow()})
+        conn.execute(namespaces_table.update().where(
+            namespaces_table.c.id == namespace_id).values(values))
+
+    _apply_resource_type_associations(
+        conn, meta, namespace_id, record['resource_type_associations'],
+        prefer_new)
+
+    for key, table in (('properties', get_metadef_properties_table(meta)),
+                       ('objects', get_metadef_objects_table(meta)),
+                       ('tags', get_metadef_tags_table(meta))):
+        _apply_records(
+            conn, table, namespace_id,
+            [dict(item, namespace_id=namespace_id) for item in record[key]],
+            prefer_new)
+
+    return True
+
+
+def _load_files(engine, meta, files, merge, prefer_new, overwrite):
+    """Load the records of files sharing a namespace, one after the other.
+
+    :param files: list of (file path, normalized record) tuples
+    :returns: the paths of the files loaded
+    """
+    loaded_files = []
+    for file, record in files:
+        # Each file is applied in its own transaction, so that a file
+        # failing half way doesn't leave a partially loaded namespace
+        try:
+            with engine.begin() as conn:
+                loaded = _load_namespace(conn, meta, record, merge,
+                                         prefer_new, overwrite)
+        except sqlalchemy.exc.IntegrityError as e:
+            LOG.error("Failed to load json file %(file_path)s due to: "
+                      "%(error_msg)s",
+                      {"file_path": file,
+                       "error_msg": encodeutils.exception_to_unicode(e)})
+            continue
+
+        if loaded:
+            LOG.info("File %s loaded to database.", file)
+            loaded_files.append(file)
+    return loaded_files
 
 
 def _populate_metadata(meta, metadata_path=None, merge=False,
-                       prefer_new=False, overwrite=False):
+                       prefer_new=False, overwrite=False, incremental=False):
     if not metadata_path:
         metadata_path = CONF.metadata_source_path
 
@@ -201,7 +507,8 @@ def _populate_metadata(meta, metadata_path=None, merge=False,
         else:
             json_schema_files = [f for f in os.listdir(metadata_path)
                                  if isfile(join(metadata_path, f))
-                                 and f.endswith('.json')]
+                                 and f.endswith('.json')
+                                 and not f.startswith('.')]
     except OSError as e:
         LOG.error(encodeutils.exception_to_unicode(e))
         return
@@ -211,268 +518,311 @@ def _populate_metadata(meta, metadata_path=None, merge=False,
                   metadata_path)
         return
 
-    namespaces_table = get_metadef_namespaces_table(meta)
-    namespace_rt_table = get_metadef_namespace_resource_types_table(meta)
-    objects_table = get_metadef_objects_table(meta)
-    tags_table = get_metadef_tags_table(meta)
-    properties_table = get_metadef_properties_table(meta)
-    resource_types_table = get_metadef_resource_types_table(meta)
-
-    for json_schema_file in json_schema_files:
-        try:
-            file = join(metadata_path, json_schema_file)
-            with open(file) as json_file:
-                metadata = json.load(json_file)
-        except Exception as e:
+    workers = CONF.metadata_load_workers
+    files = [join(metadata_path, f) for f in json_schema_files]
+    engine = _get_engine(meta)
+
+    manifest = {}
+    if incremental:
+        manifest_path = _get_manifest_path(metadata_path)
+        manifest = _read_manifest(manifest_path)
+
+    def _known_digest(file):
+        return manifest.get(os.path.basename(file), {}).get('sha256')
+
+    # Parse and check every file before writing anything, reporting all
+    # the broken ones together
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(files, executor.map(
+            lambda file: _read_metadef_file(file, _known_digest(file)),
+            files)))
+
+    unchanged = dict(
+        (file, manifest[os.path.basename(file)]['namespace'])
+        for file, (record, error, digest) in results.items()
+        if record is None and error is None)
+    if unchanged:
+        # An unchanged file still has to be loaded again if its
+        # namespace was deleted since
+        namespaces_table = get_metadef_namespaces_table(meta)
+        with engine.connect() as conn:
+            present = set(conn.execute(
+                select(namespaces_table.c.namespace).where(
+                    namespaces_table.c.namespace.in_(
+                        set(unchanged.values())))).scalars())
+        for file in [file for file, namespace in unchanged.items()
+                     if namespace not in present]:
+            del unchanged[file]
+            results[file] = _read_metadef_file(file)
+        if unchanged:
+            LOG.info("Skipping %(count)d unchanged files: %(files)s",
+                     {'count': len(unchanged),
+                      'files': ', '.join(sorted(
+                          os.path.basename(file) for file in unchanged))})
+
+    by_namespace = collections.OrderedDict()
+    for file in files:
+        record, error, digest = results[file]
+        if error is not None:
             LOG.error("Failed to parse json file %(file_path)s while "
                       "populating metadata due to: %(error_msg)s",
-                      {"file_path": file,
-                       "error_msg": encodeutils.exception_to_unicode(e)})
+                      {"file_path": file, "error_msg": error})
             continue
-
-        values = {
-            'namespace': metadata.get('namespace'),
-            'display_name': metadata.get('display_name'),
-            'description': metadata.get('description'),
-            'visibility': metadata.get('visibility'),
-            'protected': metadata.get('protected'),
-            'owner': metadata.get('owner', 'admin')
-        }
-
-        db_namespace = select(
-            [namespaces_table.c.id]
-        ).where(
-            namespaces_table.c.namespace == values['namespace']
-        ).select_from(
-            namespaces_table
-        ).execute().fetchone()
-
-        if db_namespace and overwrite:
-            LOG.info("Overwriting namespace %s", values['namespace'])
-            _clear_namespace_metadata(meta, db_namespace[0])
-            db_namespace = None
-
-        if not db_namespace:
-            values.update({'created_at': timeutils.utcnow()})
-            _insert_data_to_db(namespaces_table, values)
-
-            db_namespace = select(
-                [namespaces_table.c.id]
-            ).where(
-                namespaces_table.c.namespace == values['namespace']
-            ).select_from(
-                namespaces_table
-            ).execute().fetchone()
-        elif not merge:
-            LOG.info("Skipping namespace %s. It already exists in the "
-                     "database.", values['namespace'])
+        if file in unchanged:
             continue
-        elif prefer_new:
-            values.update({'updated_at': timeutils.utcnow()})
-            _update_data_in_db(namespaces_table, values,
-                               namespaces_table.c.id, db_namespace[0])
-
-        namespace_id = db_namespace[0]
-
-        for resource_type in metadata.get('resource_type_associations', []):
-            rt_id = _get_resource_type_id(meta, resource_type['name'])
-            if not rt_id:
-                val = {
-                    'name': resource_type['name'],
-                    'created_at': timeutils.utcnow(),
-                    'protected': True
-                }
-                _insert_data_to_db(resource_types_table, val)
-                rt_id = _get_resource_type_id(meta, resource_type['name'])
-            elif prefer_new:
-                val = {'updated_at': timeutils.utcnow()}
-                _update_data_in_db(resource_types_table, val,
-                                   resource_types_table.c.id, rt_id)
-
-            values = {
-                'namespace_id': namespace_id,
-                'resource_type_id': rt_id,
-                'properties_target': resource_type.get(
-                    'properties_target'),
-                'prefix': resource_type.get('prefix')
-            }
-            namespace_resource_type = _get_namespace_resource_type_by_ids(
-                meta, namespace_id, rt_id)
-            if not namespace_resource_type:
-                values.update({'created_at': timeutils.utcnow()})
-                _insert_data_to_db(namespace_rt_table, values)
-            elif prefer_new:
-                values.update({'updated_at': timeutils.utcnow()})
-                _update_rt_association(namespace_rt_table, values,
-                                       rt_id, namespace_id)
-
-        for name, schema in metadata.get('properties', {}).items():
-            values = {
-                'name': name,
-                'namespace_id': namespace_id,
-                'json_schema': json.dumps(schema)
-            }
-            property_id = _get_resource_id(
-                properties_table, namespace_id, name,
-            )
-            if not property_id:
-                values.update({'created_at': timeutils.utcnow()})
-                _insert_data_to_db(properties_table, values)
-            elif prefer_new:
-                values.update({'updated_at': timeutils.utcnow()})
-                _update_data_in_db(properties_table, values,
-                                   properties_table.c.id, property_id)
-
-        for object in metadata.get('objects', []):
-            values = {
-                'name': object['name'],
-                'description': object.get('description'),
-                'namespace_id': namespace_id,
-                'json_schema': json.dumps(
-                    object.get('properties'))
-            }
-            object_id = _get_resource_id(objects_table, namespace_id,
-                                         object['name'])
-            if not object_id:
-                values.update({'created_at': timeutils.utcnow()})
-                _insert_data_to_db(objects_table, values)
-            elif prefer_new:
-                values.update({'updated_at': timeutils.utcnow()})
-                _update_data_in_db(objects_table, values,
-                                   objects_table.c.id, object_id)
-
-        for tag in metadata.get('tags', []):
-            values = {
-                'name': tag.get('name'),
-                'namespace_id': namespace_id,
-            }
-            tag_id = _get_resource_id(tags_table, namespace_id, tag['name'])
-            if not tag_id:
-                values.update({'created_at': timeutils.utcnow()})
-                _insert_data_to_db(tags_table, values)
-            elif prefer_new:
-                values.update({'updated_at': timeutils.utcnow()})
-                _update_data_in_db(tags_table, values,
-                                   tags_table.c.id, tag_id)
-
-        LOG.info("File %s loaded to database.", file)
+        by_namespace.setdefault(
+            record['namespace']['namespace'], []).append((file, record))
+
+    loaded_files = _load_records(engine, meta, by_namespace, workers,
+                                 merge, prefer_new, overwrite)
+
+    if incremental:
+        entries = dict((os.path.basename(file),
+                        manifest[os.path.basename(file)])
+                       for file in unchanged)
+        for file in loaded_files:
+            entries[os.path.basename(file)] = {
+                'sha256': results[file][2],
+                'namespace': results[file][0]['namespace']['namespace']}
+        _write_manifest(manifest_path, entries)
 
     LOG.info("Metadata loading finished")
 
 
-def _insert_data_to_db(table, values, log_exception=True):
-    try:
-        table.insert(values=values).execute()
-    except sqlalchemy.exc.IntegrityError:
-        if log_exception:
-            LOG.warning("Duplicate entry for values: %s", values)
-
-
-def _update_data_in_db(table, values, column, value):
-    try:
-        (table.update(values=values).
-         where(column == value).execute())
-    except sqlalchemy.exc.IntegrityError:
-        LOG.warning("Duplicate entry for values: %s", values)
-
-
-def _update_rt_association(table, values, rt_id, namespace_id):
-    try:
-        (table.update(values=values).
-         where(and_(table.c.resource_type_id == rt_id,
-                    table.c.namespace_id == namespace_id)).execute())
-    except sqlalchemy.exc.IntegrityError:
-        LOG.warning("Duplicate entry for values: %s", values)
-
+def _load_records(engine, meta, by_namespace, workers, merge, prefer_new,
+                  overwrite):
+    """Write the normalized records of files to the database.
+
+    :param by_namespace: dict of lists of (file path, record) tuples by
+                         namespace name
+    :returns: the paths of the files loaded
+    """
+    if not by_namespace:
+        return []
+
+    # Reflect the tables up front, the apply workers share them
+    for get_table in (get_metadef_namespaces_table,
+                      get_metadef_resource_types_table,
+                      get_metadef_namespace_resource_types_table,
+                      get_metadef_properties_table,
+                      get_metadef_objects_table,
+                      get_metadef_tags_table):
+        get_table(meta)
+
+    if not merge:
+        namespaces_table = get_metadef_namespaces_table(meta)
+        with engine.connect() as conn:
+            existing = conn.execute(
+                select(namespaces_table.c.namespace).where(
+                    namespaces_table.c.namespace.in_(list(by_namespace)))
+            ).scalars().all()
+        for name in existing:
+            LOG.info("Skipping namespace %s. It already exists in the "
+                     "database.", name)
+            del by_namespace[name]
+
+    # Resource types are shared by namespaces, create them once before
+    # the namespaces are written, possibly concurrently
+    with engine.begin() as conn:
+        _ensure_resource_types(
+            conn, meta,
+            [association['name']
+             for files_records in by_namespace.values()
+             for _file, record in files_records
+             for association in record['resource_type_associations']],
+            prefer_new)
+
+    loaded_files = []
+    if workers == 1 or engine.dialect.name == 'sqlite':
+        for files_records in by_namespace.values():
+            loaded_files.extend(_load_files(engine, meta, files_records,
+                                            merge, prefer_new, overwrite))
+    else:
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(_load_files, engine, meta,
+                                           files_records, merge,
+                                           prefer_new, overwrite)
+                           for files_records in by_namespace.values()]:
+                loaded_files.extend(future.result())
+    return loaded_files
+
+
+def _group_by_namespace(rows):
+    """Return dict of lists of the rows' other columns by namespace_id"""
+    grouped = collections.defaultdict(list)
+    for row in rows:
+        grouped[row[0]].append(tuple(row[1:]))
+    return grouped
+
+
+def _fetch_export_data(meta):
+    """Fetch all the metadefs with one query per table.
+
+    :returns: the namespace rows and dicts of the resource type
+              associations, properties, objects and tags by namespace_id
+    """
+    namespaces_table = get_metadef_namespaces_table(meta)
+    rt_table = get_metadef_resource_types_table(meta)
+    namespace_rt_table = get_metadef_namespace_resource_types_table(meta)
+    properties_table = get_metadef_properties_table(meta)
+    objects_table = get_metadef_objects_table(meta)
+    tags_table = get_metadef_tags_table(meta)
 
-def _export_data_to_file(meta, path):
+    with _get_engine(meta).connect() as conn:
+        namespaces = conn.execute(
+            select(namespaces_table.c.id,
+                   namespaces_table.c.namespace,
+                   namespaces_table.c.display_name,
+                   namespaces_table.c.description,
+                   namespaces_table.c.visibility,
+                   namespaces_table.c.protected).order_by(
+                namespaces_table.c.id)).fetchall()
+        associations = _group_by_namespace(conn.execute(
+            select(namespace_rt_table.c.namespace_id,
+                   rt_table.c.name,
+                   namespace_rt_table.c.prefix,
+                   namespace_rt_table.c.properties_target).select_from(
+                namespace_rt_table.join(
+                    rt_table,
+                    namespace_rt_table.c.resource_type_id ==
+                    rt_table.c.id))))
+        properties = _group_by_namespace(conn.execute(
+            select(properties_table.c.namespace_id,
+                   properties_table.c.name,
+                   properties_table.c.json_schema).order_by(
+                properties_table.c.id)))
+        objects = _group_by_namespace(conn.execute(
+            select(objects_table.c.namespace_id,
+                   objects_table.c.name,
+                   objects_table.c.description,
+                   objects_table.c.json_schema).order_by(
+                objects_table.c.id)))
+        tags = _group_by_namespace(conn.execute(
+            select(tags_table.c.namespace_id,
+                   tags_table.c.name).order_by(tags_table.c.id)))
+
+    return namespaces, associations, properties, objects, tags
+
+
+def _write_namespace(fp, namespace, associations, properties, objects,
+                     tags):
+    """Write the JSON document of a namespace piece by piece.
+
+    The stored JSON schemas of properties and objects are embedded as
+    they are, instead of being decoded and encoded again.
+    """
+    fp.write('{')
+    for key in ('namespace', 'display_name', 'description', 'visibility',
+                'protected'):
+        fp.write('%s: %s, ' % (json.dumps(key),
+                               json.dumps(getattr(namespace, key))))
+
+    fp.write('"resource_type_associations": ')
+    fp.write(json.dumps([{'name': name,
+                          'prefix': prefix,
+                          'properties_target': properties_target}
+                         for name, prefix, properties_target
+                         in associations]))
+
+    fp.write(', "properties": {')
+    for i, (name, json_schema) in enumerate(properties):
+        fp.write('%s%s: %s' % (', ' if i else '', json.dumps(name),
+                               json_schema or 'null'))
+
+    fp.write('}, "objects": [')
+    for i, (name, description, json_schema) in enumerate(objects):
+        fp.write('%s{"name": %s, "description": %s, "properties": %s}' % (
+            ', ' if i else '', json.dumps(name), json.dumps(description),
+            json_schema or 'null'))
+
+    fp.write('], "tags": ')
+    fp.write(json.dumps([{'name': name} for (name,) in tags]))
+    fp.write('}')
+
+
+def _export_data_to_file(meta, path, archive=False):
     if not path:
         path = CONF.metadata_source_path
 
-    namespace_table = get_metadef_namespaces_table(meta)
-    namespaces = namespace_table.select().execute().fetchall()
+    namespaces, associations, properties, objects, tags = (
+        _fetch_export_data(meta))
 
     pattern = re.compile(r'[\W_]+', re.UNICODE)
 
-    for id, namespace in enumerate(namespaces, start=1):
-        namespace_id = namespace['id']
-        namespace_file_name = pattern.sub('', namespace['display_name'])
-
-        values = {
-            'namespace': namespace['namespace'],
-            'display_name': namespace['display_name'],
-            'description': namespace['description'],
-            'visibility': namespace['visibility'],
-            'protected': namespace['protected'],
-            'resource_type_associations': [],
-            'properties': {},
-            'objects': [],
-            'tags': []
-        }
-
-        namespace_resource_types = _get_namespace_resource_types(meta,
-                                                                 namespace_id)
-        db_objects = _get_objects(meta, namespace_id)
-        db_properties = _get_properties(meta, namespace_id)
-        db_tags = _get_tags(meta, namespace_id)
-
-        resource_types = []
-        for namespace_resource_type in namespace_resource_types:
-            resource_type = _get_resource_type(
-                meta, namespace_resource_type['resource_type_id'])
-            resource_types.append({
-                'name': resource_type['name'],
-                'prefix': namespace_resource_type['prefix'],
-                'properties_target': namespace_resource_type[
-                    'properties_target']
-            })
-        values.update({
-            'resource_type_associations': resource_types
-        })
-
-        objects = []
-        for object in db_objects:
-            objects.append({
-                "name": object['name'],
-                "description": object['description'],
-                "properties": json.loads(object['json_schema'])
-            })
-        values.update({
-            'objects': objects
-        })
-
-        properties = {}
-        for property in db_properties:
-            properties.update({
-                property['name']: json.loads(property['json_schema'])
-            })
-        values.update({
-            'properties': properties
-        })
-
-        tags = []
-        for tag in db_tags:
-            tags.append({
-                "name": tag['name']
-            })
-        values.update({
-            'tags': tags
-        })
+    def _documents():
+        # Display names that only differ by the stripped characters or by
+        # case would share a file, or a tar member, so the later ones get
+        # a suffix. Stripped names have no '_', so it can't clash.
+        used_names = collections.Counter()
+        for namespace in namespaces:
+            namespace_id = namespace.id
+            namespace_file_name = pattern.sub('', namespace.display_name)
+            used_names[namespace_file_name.lower()] += 1
+            count = used_names[namespace_file_name.lower()]
+            if count > 1:
+                unique_name = '%s_%d' % (namespace_file_name, count)
+                LOG.warning("Namespace %(namespace)s exported as "
+                            "%(unique)s, %(name)s is already taken.",
+                            {'namespace': namespace.namespace,
+                             'unique': unique_name,
+                             'name': namespace_file_name})
+                namespace_file_name = unique_name
+            yield (namespace_file_name, namespace,
+                   associations.get(namespace_id, []),
+                   properties.get(namespace_id, []),
+                   objects.get(namespace_id, []),
+                   tags.get(namespace_id, []))
+
+    if archive:
+        _export_to_archive(path, _documents())
+        return
 
+    def _export(document):
+        namespace_file_name = document[0]
         try:
             file_name = ''.join([path, namespace_file_name, '.json'])
             if isfile(file_name):
                 LOG.info("Overwriting: %s", file_name)
             with open(file_name, 'w') as json_file:
-                json_file.write(json.dumps(values))
+                _write_namespace(json_file, *document[1:])
         except Exception as e:
             LOG.exception(encodeutils.exception_to_unicode(e))
         LOG.info("Namespace %(namespace)s saved in %(file)s", {
             'namespace': namespace_file_name, 'file': file_name})
 
+    with futures.ThreadPoolExecutor(
+            max_workers=CONF.metadata_load_workers) as executor:
+        list(executor.map(_export, _documents()))
+
+
+def _export_to_archive(path, documents):
+    """Write the namespace documents into a single gzipped tarball.
+
+    :param path: name of the archive, or directory to write
+                 metadefs.tar.gz in
+    """
+    if os.path.isdir(path):
+        path = join(path, 'metadefs.tar.gz')
+    if isfile(path):
+        LOG.info("Overwriting: %s", path)
+
+    with tarfile.open(path, 'w:gz') as tar:
+        for document in documents:
+            namespace_file_name = document[0] + '.json'
+            buf = io.StringIO()
+            _write_namespace(buf, *document[1:])
+            data = buf.getvalue().encode('utf-8')
+
+            member = tarfile.TarInfo(namespace_file_name)
+            member.size = len(data)
+            member.mtime = int(time.time())
+            tar.addfile(member, io.BytesIO(data))
+            LOG.info("Namespace %(namespace)s saved in %(file)s", {
+                'namespace': document[0], 'file': path})
+
 
 def db_load_metadefs(engine, metadata_path=None, merge=False,
-                     prefer_new=False, overwrite=False):
+                     prefer_new=False, overwrite=False, incremental=False):
     meta = MetaData()
     meta.bind = engine
 
@@ -486,7 +836,8 @@ def db_load_metadefs(engine, metadata_path=None, merge=False,
                   "--prefer_new, --overwrite")
         return
 
-    _populate_metadata(meta, metadata_path, merge, prefer_new, overwrite)
+    _populate_metadata(meta, metadata_path, merge, prefer_new, overwrite,
+                       incremental)
 
 
 def db_unload_metadefs(engine):
@@ -496,8 +847,8 @@ def db_unload_metadefs(engine):
     _clear_metadata(meta)
 
 
-def db_export_metadefs(engine, metadata_path=None):
+def db_export_metadefs(engine, metadata_path=None, archive=False):
     meta = MetaData()
     meta.bind = engine
 
-    _export_data_to_file(meta, metadata_path)
+    _export_data_to_file(meta, metadata_path, archive)
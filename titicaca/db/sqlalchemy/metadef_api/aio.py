@@ -0,0 +1,323 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+"""
+Asyncio variant of the metadata definition read API
+
+The coroutines here mirror the read functions of the namespace, object,
+property, tag and resource type association modules: same arguments,
+same returned dicts, same exceptions and visibility rules. They take an
+AsyncSession, as returned by get_session(), in place of the oslo.db
+session, and run on SQLAlchemy's asyncio engine for the configured
+database, e.g.::
+
+    async with aio.get_session() as session:
+        namespace = await aio.namespace_get(context, name, session)
+
+The asyncio driver of the database backend must be installed: aiosqlite,
+aiomysql or asyncpg, all pulled in by the titicaca[asyncio] extra.
+"""
+
+import threading
+
+from oslo_config import cfg
+from oslo_db import options as db_options
+from oslo_log import log as logging
+from sqlalchemy import engine as sa_engine
+import sqlalchemy.exc as sa_exc
+from sqlalchemy.ext import asyncio as sa_asyncio
+from sqlalchemy import select
+
+from titicaca.common import exception as exc
+from titicaca.db.sqlalchemy.metadef_api import cache as metadef_cache
+from titicaca.db.sqlalchemy.metadef_api import namespace as namespace_api
+import titicaca.db.sqlalchemy.metadef_api.utils as metadef_utils
+from titicaca.db.sqlalchemy import models_metadef as models
+from titicaca.i18n import _
+
+LOG = logging.getLogger(__name__)
+
+CONF = cfg.CONF
+# NOTE: The [database] options are otherwise only registered once the
+# oslo.db engine facade is created.
+db_options.set_defaults(CONF)
+
+# asyncio drivers used for database URLs naming a blocking driver
+_ASYNC_DRIVERS = {
+    'sqlite': 'aiosqlite',
+    'mysql': 'aiomysql',
+    'postgresql': 'asyncpg',
+}
+
+_ENGINE = None
+_SESSION_MAKER = None
+_LOCK = threading.Lock()
+
+
+def get_async_url(url):
+    """Return url with its driver replaced by an asyncio one if needed."""
+    url = sa_engine.make_url(url)
+    if url.get_dialect().is_async:
+        return url
+
+    backend = url.get_backend_name()
+    driver = _ASYNC_DRIVERS.get(backend)
+    if driver is None:
+        raise exc.Invalid(_("No asyncio database driver is known for the "
+                            "%s backend.") % backend)
+    return url.set(drivername='%s+%s' % (backend, driver))
+
+
+def get_engine():
+    """Return the asyncio engine for [database]/connection, made once."""
+    global _ENGINE, _SESSION_MAKER
+    if _ENGINE is None:
+        with _LOCK:
+            if _ENGINE is None:
+                _ENGINE = sa_asyncio.create_async_engine(
+                    get_async_url(CONF.database.connection),
+                    pool_pre_ping=True)
+                _SESSION_MAKER = sa_asyncio.async_sessionmaker(
+                    _ENGINE, expire_on_commit=False)
+    return _ENGINE
+
+
+def get_session():
+    """Return a new AsyncSession, to be used as an async context manager"""
+    get_engine()
+    return _SESSION_MAKER()
+
+
+async def dispose():
+    """Close the connections of the engine and forget it."""
+    global _ENGINE, _SESSION_MAKER
+    engine = _ENGINE
+    _ENGINE = None
+    _SESSION_MAKER = None
+    if engine is not None:
+        await engine.dispose()
+
+
+async def _get_namespace_by_id(context, namespace_id, session):
+    """Get a namespace dict by id, raise if not found or not visible"""
+    result = await session.execute(
+        namespace_api._select_by_id(context, namespace_id))
+    namespace_rec = result.scalar_one_or_none()
+    if namespace_rec is None:
+        result = await session.execute(
+            namespace_api._select_name_by_id(namespace_id))
+        namespace_api._raise_missing_by_id(
+            namespace_id, result.scalar_one_or_none())
+    return namespace_rec.to_dict()
+
+
+async def namespace_get(context, name, session):
+    """Get a namespace by name, raise if not found"""
+    result = await session.execute(
+        namespace_api._select_by_name(context, name))
+    namespace_rec = result.scalar_one_or_none()
+    if namespace_rec is None:
+        result = await session.execute(namespace_api._select_id_by_name(name))
+        namespace_api._raise_missing_by_name(
+            name, result.scalar_one_or_none() is not None)
+    return namespace_rec.to_dict()
+
+
+async def _get_namespace_ref(context, name, session):
+    """Async counterpart of namespace.get_ref, sharing its cache."""
+    cache = metadef_cache.get_namespace_cache()
+    namespace = cache.get(name)
+    if namespace is None:
+        result = await session.execute(
+            namespace_api._select_ref_by_name(context, name))
+        row = result.one_or_none()
+        if row is None:
+            result = await session.execute(
+                namespace_api._select_id_by_name(name))
+            namespace_api._raise_missing_by_name(
+                name, result.scalar_one_or_none() is not None)
+        namespace = row._asdict()
+        cache.put(namespace)
+    else:
+        namespace_api._check_namespace_visible(context, namespace, name)
+    return namespace
+
+
+async def _get_marker_values(model, marker_id, sort_keys, session):
+    """Return the sort key values of a legacy id marker row."""
+    result = await session.execute(
+        select(*[getattr(model, key) for key in sort_keys]).where(
+            model.id == marker_id))
+    row = result.one_or_none()
+    if row is None:
+        raise sa_exc.NoResultFound()
+    return dict(zip(sort_keys, row))
+
+
+async def _paginate(model, stmt, marker, limit, sort_key, sort_dir,
+                    session):
+    sort_keys = metadef_utils.get_sort_keys(sort_key)
+    marker_values = None
+    if marker is not None:
+        marker_values = metadef_utils.decode_cursor(
+            marker, sort_keys, sort_dir)
+        if marker_values is None:
+            marker_values = await _get_marker_values(
+                model, marker, sort_keys, session)
+    return metadef_utils.paginate(stmt, model, limit, sort_keys,
+                                  sort_dir, marker_values)
+
+
+async def namespace_get_all(context, session, marker=None, limit=None,
+                            sort_key=None, sort_dir=None, filters=None):
+    """List all visible namespaces"""
+    filters = filters or {}
+    sort_key = sort_key or 'created_at'
+    sort_dir = sort_dir or 'desc'
+    model = models.MetadefNamespace
+
+    stmt = select(*model.dict_columns())
+    stmt = namespace_api._apply_visibility(stmt, context)
+    stmt = namespace_api._apply_filters(stmt, filters)
+
+    sort_keys = metadef_utils.get_sort_keys(sort_key)
+    marker_values = None
+    if marker is not None:
+        marker_values = metadef_utils.decode_cursor(
+            marker, sort_keys, sort_dir)
+        if marker_values is None:
+            marker_namespace = await _get_namespace_by_id(
+                context, marker, session)
+            marker_values = dict((key, marker_namespace[key])
+                                 for key in sort_keys)
+    stmt = metadef_utils.paginate(stmt, model, limit, sort_keys, sort_dir,
+                                  marker_values)
+
+    result = await session.execute(stmt)
+    return model.rows_to_dicts(result.all())
+
+
+async def _content_get(context, model, namespace_name, name, session):
+    namespace = await _get_namespace_ref(context, namespace_name, session)
+    result = await session.execute(
+        select(*model.dict_columns()).where(
+            model.namespace_id == namespace['id'], model.name == name))
+    row = result.one_or_none()
+    return None if row is None else model.rows_to_dicts([row])[0]
+
+
+async def _content_get_all(context, model, not_found, namespace_name,
+                           session, marker, limit, sort_key, sort_dir,
+                           always_paginate):
+    namespace = await _get_namespace_ref(context, namespace_name, session)
+    stmt = select(*model.dict_columns()).where(
+        model.namespace_id == namespace['id'])
+
+    if always_paginate or marker is not None or limit is not None:
+        try:
+            stmt = await _paginate(model, stmt, marker, limit, sort_key,
+                                   sort_dir, session)
+        except sa_exc.NoResultFound:
+            msg = not_found[1] % marker
+            LOG.warning(msg)
+            raise not_found[0](msg)
+
+    result = await session.execute(stmt)
+    return model.rows_to_dicts(result.all())
+
+
+async def object_get(context, namespace_name, name, session):
+    md_object = await _content_get(
+        context, models.MetadefObject, namespace_name, name, session)
+    if md_object is None:
+        LOG.debug("The metadata definition object with name=%(name)s"
+                  " was not found in namespace=%(namespace_name)s.",
+                  {'name': name, 'namespace_name': namespace_name})
+        raise exc.MetadefObjectNotFound(object_name=name,
+                                        namespace_name=namespace_name)
+    return md_object
+
+
+async def object_get_all(context, namespace_name, session, marker=None,
+                         limit=None, sort_key='created_at', sort_dir='desc'):
+    """Get the objects of a namespace, paginated if marker or limit is set.
+
+    See object.get_all.
+    """
+    return await _content_get_all(
+        context, models.MetadefObject,
+        (exc.MetadefObjectNotFound,
+         _("Metadata definition object not found for id=%s")),
+        namespace_name, session, marker, limit, sort_key, sort_dir, False)
+
+
+async def property_get(context, namespace_name, name, session):
+    """get a property; raise if ns not found/visible or property not found"""
+    property_rec = await _content_get(
+        context, models.MetadefProperty, namespace_name, name, session)
+    if property_rec is None:
+        LOG.debug("The metadata definition property with name=%(name)s"
+                  " was not found in namespace=%(namespace_name)s.",
+                  {'name': name, 'namespace_name': namespace_name})
+        raise exc.MetadefPropertyNotFound(property_name=name,
+                                          namespace_name=namespace_name)
+    return property_rec
+
+
+async def property_get_all(context, namespace_name, session, marker=None,
+                           limit=None, sort_key='created_at',
+                           sort_dir='desc'):
+    """Get the properties of a namespace, paginated if marker or limit is set.
+
+    See property.get_all.
+    """
+    return await _content_get_all(
+        context, models.MetadefProperty,
+        (exc.MetadefPropertyNotFound,
+         _("Metadata definition property not found for id=%s")),
+        namespace_name, session, marker, limit, sort_key, sort_dir, False)
+
+
+async def tag_get(context, namespace_name, name, session):
+    metadef_tag = await _content_get(
+        context, models.MetadefTag, namespace_name, name, session)
+    if metadef_tag is None:
+        LOG.debug("The metadata tag with name=%(name)s"
+                  " was not found in namespace=%(namespace_name)s.",
+                  {'name': name, 'namespace_name': namespace_name})
+        raise exc.MetadefTagNotFound(name=name,
+                                     namespace_name=namespace_name)
+    return metadef_tag
+
+
+async def tag_get_all(context, namespace_name, session, filters=None,
+                      marker=None, limit=None, sort_key='created_at',
+                      sort_dir='desc'):
+    """Get all tags of a namespace, see tag.get_all."""
+    return await _content_get_all(
+        context, models.MetadefTag,
+        (exc.MetadefTagNotFound, _("Metadata tag not found for id %s")),
+        namespace_name, session, marker, limit, sort_key, sort_dir, True)
+
+
+async def resource_type_association_get_all_by_namespace(
+        context, namespace_name, session):
+    """List resource_type associations by namespace, raise if not found"""
+    namespace = await _get_namespace_ref(context, namespace_name, session)
+    association = models.MetadefNamespaceResourceType
+    result = await session.execute(
+        select(models.MetadefResourceType.name,
+               association.properties_target,
+               association.prefix,
+               association.created_at,
+               association.updated_at)
+        .join(models.MetadefResourceType.associations)
+        .where(association.namespace_id == namespace['id']))
+
+    return [{'name': name,
+             'properties_target': properties_target,
+             'prefix': prefix,
+             'created_at': created_at,
+             'updated_at': updated_at}
+            for (name, properties_target, prefix,
+                 created_at, updated_at) in result]
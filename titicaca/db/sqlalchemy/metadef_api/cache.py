@@ -0,0 +1,209 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+"""
+Process wide caches for metadata definition lookups
+"""
+
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from titicaca.i18n import _
+
+LOG = logging.getLogger(__name__)
+
+cache_opts = [
+    cfg.IntOpt('metadef_namespace_cache_ttl',
+               default=10,
+               min=0,
+               help=_("""
+Time in seconds a metadata definition namespace lookup is cached.
+
+Nearly every metadef tag, object, property and resource type
+association call starts by resolving its namespace by name. The id,
+owner and visibility of namespaces are kept in a process wide cache
+for this long, and the per-request visibility check of read calls is
+done against the cached values. Calls that write always look their
+namespace up in the database. Changes made through this process
+invalidate the cache immediately; changes made by other workers become
+visible to reads after at most this many seconds.
+
+Possible values:
+    * 0 disables the cache
+    * Positive integer
+
+Related options:
+    * None
+
+""")),
+    cfg.IntOpt('metadef_resource_type_cache_probe_interval',
+               default=5,
+               min=0,
+               help=_("""
+Time in seconds between checks of the cached resource types.
+
+The metadata definition resource types are kept in a process wide
+cache, as resource type associations look them up by name on every
+call and they hardly ever change. Changes made through this process
+invalidate the cache immediately. To pick up changes made by other
+workers, the cache is checked against the row count, the sum of the
+ids and the latest creation and update times of the resource types
+table when it is used and was last checked longer ago than this; it is
+reloaded only if they differ. A name missing from the cache is always
+looked up in the database before it is reported as not found.
+
+Possible values:
+    * 0 checks the cache on every lookup
+    * Positive integer
+
+Related options:
+    * None
+
+""")),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(cache_opts)
+
+
+class NamespaceCache(object):
+    """Cache of namespace id, owner and visibility by name and by id."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_name = {}
+        self._by_id = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name):
+        """Return the cached namespace reference for name, or None."""
+        with self._lock:
+            entry = self._by_name.get(name)
+            if entry is not None and entry[1] > time.monotonic():
+                self.hits += 1
+                return dict(entry[0])
+            self.misses += 1
+            return None
+
+    def get_by_id(self, namespace_id):
+        """Return the cached namespace reference for an id, or None."""
+        with self._lock:
+            entry = self._by_id.get(namespace_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self.hits += 1
+                return dict(entry[0])
+            self.misses += 1
+            return None
+
+    def put(self, namespace):
+        """Cache a namespace reference.
+
+        :param namespace: dict holding at least the id, namespace, owner
+                          and visibility keys
+        """
+        ttl = CONF.metadef_namespace_cache_ttl
+        if not ttl:
+            return
+        ref = {'id': namespace['id'],
+               'namespace': namespace['namespace'],
+               'owner': namespace['owner'],
+               'visibility': namespace['visibility']}
+        entry = (ref, time.monotonic() + ttl)
+        with self._lock:
+            self._by_name[ref['namespace']] = entry
+            self._by_id[ref['id']] = entry
+
+    def invalidate(self, name=None, namespace_id=None):
+        """Drop the entries for a namespace name and/or id."""
+        with self._lock:
+            for entry in (self._by_name.pop(name, None),
+                          self._by_id.pop(namespace_id, None)):
+                if entry is not None:
+                    self._by_name.pop(entry[0]['namespace'], None)
+                    self._by_id.pop(entry[0]['id'], None)
+
+    def clear(self):
+        with self._lock:
+            self._by_name.clear()
+            self._by_id.clear()
+
+    def stats(self):
+        """Return the hit and miss counters and the number of entries."""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'entries': len(self._by_name)}
+
+
+_NAMESPACE_CACHE = NamespaceCache()
+
+
+def get_namespace_cache():
+    return _NAMESPACE_CACHE
+
+
+class ResourceTypeCache(object):
+    """Cache of all resource types by name, tagged with a table version.
+
+    The version is any value that changes whenever the resource types
+    table does; it is compared to decide whether the cached map can be
+    reused after the probe interval has passed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_name = None
+        self._version = None
+        self._checked_at = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        """Return the cached map if it was checked recently, or None."""
+        interval = CONF.metadef_resource_type_cache_probe_interval
+        with self._lock:
+            if (self._by_name is not None and
+                    time.monotonic() < self._checked_at + interval):
+                self.hits += 1
+                return self._by_name
+            return None
+
+    def get_if_version(self, version):
+        """Return the cached map if it is at version, or None."""
+        with self._lock:
+            if self._by_name is not None and self._version == version:
+                self._checked_at = time.monotonic()
+                self.hits += 1
+                return self._by_name
+            self.misses += 1
+            return None
+
+    def put(self, version, by_name):
+        """Cache the map of resource type dicts by name at version."""
+        with self._lock:
+            self._by_name = by_name
+            self._version = version
+            self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._by_name = None
+            self._version = None
+
+    def stats(self):
+        """Return the hit and miss counters and the number of entries."""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'entries': len(self._by_name or ())}
+
+
+_RESOURCE_TYPE_CACHE = ResourceTypeCache()
+
+
+def get_resource_type_cache():
+    return _RESOURCE_TYPE_CACHE
@@ -3,14 +3,18 @@
 # All rights reserved.
 
 from oslo_db import exception as db_exc
-from oslo_db.sqlalchemy.utils import paginate_query
 from oslo_log import log as logging
 import sqlalchemy.exc as sa_exc
+from sqlalchemy import exists
+from sqlalchemy import func
+from sqlalchemy import lambda_stmt
 from sqlalchemy import or_
-import sqlalchemy.orm as sa_orm
+from sqlalchemy import select
 
 from titicaca.common import exception as exc
 import titicaca.db.sqlalchemy.metadef_api as metadef_api
+from titicaca.db.sqlalchemy.metadef_api import cache as metadef_cache
+import titicaca.db.sqlalchemy.metadef_api.utils as metadef_utils
 from titicaca.db.sqlalchemy import models_metadef as models
 from titicaca.i18n import _
 
@@ -42,91 +46,159 @@ def _is_namespace_visible(context, namespace, status=None):
     return False
 
 
+def _apply_visibility(query, context):
+    """Restrict a namespace query or select to what context can see"""
+
+    # If admin, return everything.
+    if context.is_admin:
+        return query
+
+    # If regular user, return only public namespaces.
+    # However, if context.owner has a value, return both
+    # public and private namespaces of the context.owner.
+    if context.owner is not None:
+        return query.filter(
+            or_(models.MetadefNamespace.owner == context.owner,
+                models.MetadefNamespace.visibility == 'public'))
+    return query.filter(models.MetadefNamespace.visibility == 'public')
+
+
 def _select_namespaces_query(context, session):
     """Build the query to get all namespaces based on the context"""
 
     LOG.debug("context.is_admin=%(is_admin)s; context.owner=%(owner)s",
               {'is_admin': context.is_admin, 'owner': context.owner})
 
-    # If admin, return everything.
     query_ns = session.query(models.MetadefNamespace)
+    return _apply_visibility(query_ns, context)
+
+
+def _where_visible(stmt, context):
+    """Add the namespace visibility rules of context to a lambda statement.
+
+    This is _is_namespace_visible() as a SQL predicate: admins see every
+    namespace, others those without owner, the public ones and their own.
+    """
     if context.is_admin:
-        return query_ns
-    else:
-        # If regular user, return only public namespaces.
-        # However, if context.owner has a value, return both
-        # public and private namespaces of the context.owner.
-        if context.owner is not None:
-            query = (
-                query_ns.filter(
-                    or_(models.MetadefNamespace.owner == context.owner,
-                        models.MetadefNamespace.visibility == 'public')))
-        else:
-            query = query_ns.filter(
-                models.MetadefNamespace.visibility == 'public')
-        return query
+        return stmt
 
+    owner = context.owner
+    if owner is None:
+        return stmt + (lambda s: s.where(or_(
+            models.MetadefNamespace.owner.is_(None),
+            models.MetadefNamespace.visibility == 'public')))
+    return stmt + (lambda s: s.where(or_(
+        models.MetadefNamespace.owner.is_(None),
+        models.MetadefNamespace.visibility == 'public',
+        models.MetadefNamespace.owner == owner)))
 
-def _get(context, namespace_id, session):
-    """Get a namespace by id, raise if not found"""
 
-    try:
-        query = session.query(models.MetadefNamespace).filter_by(
-            id=namespace_id)
-        namespace_rec = query.one()
-    except sa_orm.exc.NoResultFound:
+def _select_by_id(context, namespace_id):
+    """Select the namespace with an id if it is visible in context"""
+    stmt = lambda_stmt(lambda: select(models.MetadefNamespace).where(
+        models.MetadefNamespace.id == namespace_id))
+    return _where_visible(stmt, context)
+
+
+def _select_by_name(context, name):
+    """Select the namespace with a name if it is visible in context"""
+    stmt = lambda_stmt(lambda: select(models.MetadefNamespace).where(
+        models.MetadefNamespace.namespace == name))
+    return _where_visible(stmt, context)
+
+
+def _select_ref_by_name(context, name):
+    """Select the get_ref() columns of a namespace visible in context"""
+    stmt = lambda_stmt(lambda: select(
+        models.MetadefNamespace.id,
+        models.MetadefNamespace.namespace,
+        models.MetadefNamespace.owner,
+        models.MetadefNamespace.visibility).where(
+            models.MetadefNamespace.namespace == name))
+    return _where_visible(stmt, context)
+
+
+def _select_name_by_id(namespace_id):
+    """Select the name of a namespace whatever its visibility"""
+    return lambda_stmt(lambda: select(models.MetadefNamespace.namespace).where(
+        models.MetadefNamespace.id == namespace_id))
+
+
+def _select_id_by_name(name):
+    """Select the id of a namespace whatever its visibility"""
+    return lambda_stmt(lambda: select(models.MetadefNamespace.id).where(
+        models.MetadefNamespace.namespace == name))
+
+
+def _raise_forbidden(name):
+    LOG.debug("Forbidding request, metadata definition namespace=%s"
+              " is not visible.", name)
+    emsg = _("Forbidding request, metadata definition namespace=%s"
+             " is not visible.") % name
+    raise exc.MetadefForbidden(emsg)
+
+
+def _raise_missing_by_id(namespace_id, name):
+    """Raise for an id the visibility predicate found nothing for.
+
+    :param name: name of the namespace with that id if there is one,
+                 i.e. it exists but isn't visible
+    """
+    if name is None:
         msg = (_("Metadata definition namespace not found for id=%s")
                % namespace_id)
         LOG.warning(msg)
         raise exc.MetadefNamespaceNotFound(msg)
+    _raise_forbidden(name)
 
-    # Make sure they are allowed to view it.
-    if not _is_namespace_visible(context, namespace_rec.to_dict()):
-        LOG.debug("Forbidding request, metadata definition namespace=%s"
-                  " is not visible.", namespace_rec.namespace)
-        emsg = _("Forbidding request, metadata definition namespace=%s"
-                 " is not visible.") % namespace_rec.namespace
-        raise exc.MetadefForbidden(emsg)
+
+def _raise_missing_by_name(name, exists):
+    """Raise for a name the visibility predicate found nothing for."""
+    if not exists:
+        LOG.debug("Metadata definition namespace=%s was not found.", name)
+        raise exc.MetadefNamespaceNotFound(namespace_name=name)
+    _raise_forbidden(name)
+
+
+def _get(context, namespace_id, session):
+    """Get a namespace by id, raise if not found or not visible"""
+
+    namespace_rec = session.execute(
+        _select_by_id(context, namespace_id)).scalar_one_or_none()
+    if namespace_rec is None:
+        # Only now tell a namespace that isn't there from a private one
+        name = session.execute(
+            _select_name_by_id(namespace_id)).scalar_one_or_none()
+        _raise_missing_by_id(namespace_id, name)
 
     return namespace_rec
 
 
 def _get_by_name(context, name, session):
-    """Get a namespace by name, raise if not found"""
+    """Get a namespace by name, raise if not found or not visible"""
 
-    try:
-        query = session.query(models.MetadefNamespace).filter_by(
-            namespace=name)
-        namespace_rec = query.one()
-    except sa_orm.exc.NoResultFound:
-        LOG.debug("Metadata definition namespace=%s was not found.", name)
-        raise exc.MetadefNamespaceNotFound(namespace_name=name)
-
-    # Make sure they are allowed to view it.
-    if not _is_namespace_visible(context, namespace_rec.to_dict()):
-        LOG.debug("Forbidding request, metadata definition namespace=%s"
-                  " is not visible.", name)
-        emsg = _("Forbidding request, metadata definition namespace=%s"
-                 " is not visible.") % name
-        raise exc.MetadefForbidden(emsg)
+    namespace_rec = session.execute(
+        _select_by_name(context, name)).scalar_one_or_none()
+    if namespace_rec is None:
+        namespace_id = session.execute(
+            _select_id_by_name(name)).scalar_one_or_none()
+        _raise_missing_by_name(name, namespace_id is not None)
 
     return namespace_rec
 
 
-def _get_all(context, session, filters=None, marker=None,
-             limit=None, sort_key='created_at', sort_dir='desc'):
-    """Get all namespaces that match zero or more filters.
+def _check_namespace_visible(context, namespace, name):
+    """Raise MetadefForbidden if the namespace is not visible."""
+    if not _is_namespace_visible(context, namespace):
+        _raise_forbidden(name)
 
-    :param filters: dict of filter keys and values.
-    :param marker: namespace id after which to start page
-    :param limit: maximum number of namespaces to return
-    :param sort_key: namespace attribute by which results should be sorted
-    :param sort_dir: direction in which results should be sorted (asc, desc)
-    """
 
-    filters = filters or {}
+def _apply_filters(query, filters):
+    """Apply the namespace listing filters to a query or select.
 
-    query = _select_namespaces_query(context, session)
+    :param filters: dict of filter keys and values, the recognized ones
+                    are popped from it.
+    """
 
     # if visibility filter, apply it to the context based query
     visibility = filters.pop('visibility', None)
@@ -138,65 +210,66 @@ def _get_all(context, session, filters=None, marker=None,
     if id_list is not None:
         query = query.filter(models.MetadefNamespace.id.in_(id_list))
 
-    marker_namespace = None
-    if marker is not None:
-        marker_namespace = _get(context, marker, session)
+    # if resource_types filter, keep the namespaces associated with any of
+    # them through a semi-join evaluated in the same statement
+    resource_types = filters.pop('resource_types', None)
+    if resource_types is not None:
+        resource_type_list = resource_types.split(',')
+        query = query.filter(
+            exists()
+            .where(models.MetadefNamespaceResourceType.namespace_id ==
+                   models.MetadefNamespace.id)
+            .where(models.MetadefNamespaceResourceType.resource_type_id ==
+                   models.MetadefResourceType.id)
+            .where(models.MetadefResourceType.name.in_(resource_type_list)))
 
-    sort_keys = ['created_at', 'id']
-    sort_keys.insert(0, sort_key) if sort_key not in sort_keys else sort_keys
+    return query
 
-    query = paginate_query(query=query,
-                           model=models.MetadefNamespace,
-                           limit=limit,
-                           sort_keys=sort_keys,
-                           marker=marker_namespace, sort_dir=sort_dir)
-
-    return query.all()
 
+def _get_all(context, session, filters=None, marker=None,
+             limit=None, sort_key='created_at', sort_dir='desc'):
+    """Get all namespaces that match zero or more filters.
 
-def _get_all_by_resource_types(context, session, filters, marker=None,
-                               limit=None, sort_key=None, sort_dir=None):
-    """get all visible namespaces for the specified resource_types"""
+    :param filters: dict of filter keys and values.
+    :param marker: cursor made by metadef_api.utils.make_cursor, or the
+                   namespace id after which to start page
+    :param limit: maximum number of namespaces to return
+    :param sort_key: namespace attribute by which results should be sorted
+    :param sort_dir: direction in which results should be sorted (asc, desc)
+    """
 
-    resource_types = filters['resource_types']
-    resource_type_list = resource_types.split(',')
-    db_recs = (
-        session.query(models.MetadefResourceType)
-        .join(models.MetadefResourceType.associations)
-        .filter(models.MetadefResourceType.name.in_(resource_type_list))
-        .values(models.MetadefResourceType.name,
-                models.MetadefNamespaceResourceType.namespace_id)
-    )
+    filters = filters or {}
+    sort_key = sort_key or 'created_at'
+    sort_dir = sort_dir or 'desc'
 
-    namespace_id_list = []
-    for name, namespace_id in db_recs:
-        namespace_id_list.append(namespace_id)
+    query = _select_namespaces_query(context, session)
+    query = _apply_filters(query, filters)
 
-    if len(namespace_id_list) == 0:
-        return []
+    sort_keys = metadef_utils.get_sort_keys(sort_key)
+    marker_values = None
+    if marker is not None:
+        marker_values = metadef_utils.decode_cursor(
+            marker, sort_keys, sort_dir)
+        if marker_values is None:
+            marker_namespace = _get(context, marker, session)
+            marker_values = dict((key, getattr(marker_namespace, key))
+                                 for key in sort_keys)
 
-    filters2 = filters
-    filters2.update({'id_list': namespace_id_list})
+    query = query.with_entities(*models.MetadefNamespace.dict_columns())
+    query = metadef_utils.paginate(query, models.MetadefNamespace, limit,
+                                   sort_keys, sort_dir, marker_values)
 
-    return _get_all(context, session, filters2,
-                    marker, limit, sort_key, sort_dir)
+    return query.all()
 
 
 def get_all(context, session, marker=None, limit=None,
             sort_key=None, sort_dir=None, filters=None):
     """List all visible namespaces"""
 
-    namespaces = []
-    filters = filters or {}
-
-    if 'resource_types' in filters:
-        namespaces = _get_all_by_resource_types(
-            context, session, filters, marker, limit, sort_key, sort_dir)
-    else:
-        namespaces = _get_all(
-            context, session, filters, marker, limit, sort_key, sort_dir)
+    namespaces = _get_all(
+        context, session, filters, marker, limit, sort_key, sort_dir)
 
-    return [ns.to_dict() for ns in namespaces]
+    return models.MetadefNamespace.rows_to_dicts(namespaces)
 
 
 def get(context, name, session):
@@ -205,6 +278,112 @@ def get(context, name, session):
     return namespace_rec.to_dict()
 
 
+def get_ref(context, name, session, cached=True):
+    """Get the id, owner and visibility of a namespace by name.
+
+    This is what the tag, object, property and association calls need to
+    resolve their namespace, so reads are served from the process wide
+    namespace cache when possible. The visibility check is still done for
+    every call. On a cache miss, the visibility rules are applied in the
+    lookup statement, and a second query is made only when it finds
+    nothing, to tell Forbidden from NotFound. Raise if not found or not
+    visible.
+
+    :param cached: False to always look the namespace up in the database;
+                   write paths must not act on an id or visibility that
+                   another worker may have changed since it was cached
+    """
+    cache = metadef_cache.get_namespace_cache()
+    namespace = cache.get(name) if cached else None
+    if namespace is None:
+        row = session.execute(
+            _select_ref_by_name(context, name)).one_or_none()
+        if row is None:
+            namespace_id = session.execute(
+                _select_id_by_name(name)).scalar_one_or_none()
+            _raise_missing_by_name(name, namespace_id is not None)
+        namespace = row._asdict()
+        cache.put(namespace)
+    else:
+        _check_namespace_visible(context, namespace, name)
+    return namespace
+
+
+def get_full(context, name, session):
+    """Get a namespace with all of its content, raise if not found.
+
+    The namespace, its objects, properties, tags and resource type
+    associations are loaded with a fixed number of queries, however big
+    the namespace is, and returned as one ready to serialize dict.
+    """
+    namespace_rec = _get_by_name(context, name, session)
+    namespace_id = namespace_rec.id
+
+    def _content(model):
+        query = session.query(*model.dict_columns()).filter(
+            model.namespace_id == namespace_id)
+        return model.rows_to_dicts(query)
+
+    associations = (
+        session.query(models.MetadefResourceType.name,
+                      models.MetadefNamespaceResourceType.properties_target,
+                      models.MetadefNamespaceResourceType.prefix,
+                      models.MetadefNamespaceResourceType.created_at,
+                      models.MetadefNamespaceResourceType.updated_at)
+        .join(models.MetadefResourceType.associations)
+        .filter(models.MetadefNamespaceResourceType.namespace_id ==
+                namespace_id))
+
+    namespace = namespace_rec.to_dict()
+    namespace.update({
+        'resource_type_associations': [
+            {'name': rt_name,
+             'properties_target': properties_target,
+             'prefix': prefix,
+             'created_at': created_at,
+             'updated_at': updated_at}
+            for (rt_name, properties_target, prefix,
+                 created_at, updated_at) in associations],
+        'objects': _content(models.MetadefObject),
+        'properties': _content(models.MetadefProperty),
+        'tags': _content(models.MetadefTag),
+    })
+    return namespace
+
+
+def count_content(context, namespace_ids, session):
+    """Count the content of several namespaces, one query per table.
+
+    Use this def only for namespaces already verified as visible, e.g.
+    the ones returned by get_all.
+
+    :param namespace_ids: list of namespace ids
+    :returns: dict mapping every namespace id to a dict with the number of
+              its objects, properties, tags and resource_types
+    """
+    counts = dict((namespace_id, {'objects': 0, 'properties': 0,
+                                  'tags': 0, 'resource_types': 0})
+                  for namespace_id in namespace_ids)
+    if not counts:
+        return counts
+
+    for key, model, column in (
+            ('objects', models.MetadefObject, models.MetadefObject.id),
+            ('properties', models.MetadefProperty,
+             models.MetadefProperty.id),
+            ('tags', models.MetadefTag, models.MetadefTag.id),
+            ('resource_types', models.MetadefNamespaceResourceType,
+             models.MetadefNamespaceResourceType.resource_type_id)):
+        query = (
+            session.query(model.namespace_id, func.count(column))
+            .filter(model.namespace_id.in_(list(counts)))
+            .group_by(model.namespace_id))
+        for namespace_id, count in query:
+            counts[namespace_id][key] = count
+
+    return counts
+
+
 def create(context, values, session):
     """Create a namespace, raise if namespace already exists."""
 
@@ -220,6 +399,7 @@ def create(context, values, session):
         raise exc.MetadefDuplicateNamespace(
             namespace_name=namespace_name)
 
+    metadef_cache.get_namespace_cache().invalidate(name=namespace_name)
     return namespace.to_dict()
 
 
@@ -241,6 +421,8 @@ def update(context, namespace_id, values, session):
                 % values['namespace'])
         raise exc.MetadefDuplicateNamespace(emsg)
 
+    metadef_cache.get_namespace_cache().invalidate(
+        name=namespace_rec.namespace, namespace_id=namespace_id)
     return namespace_rec.to_dict()
 
 
@@ -260,32 +442,92 @@ def delete(context, name, session):
         else:
             raise
 
+    metadef_cache.get_namespace_cache().invalidate(
+        name=name, namespace_id=namespace_rec.id)
     return namespace_rec.to_dict()
 
 
-def delete_cascade(context, name, session):
-    """Raise if not found, has references or not visible"""
+# Namespace content tables, in deletion order, keyed as in the counts
+# returned by delete_cascade_bulk
+_CONTENT_MODELS = (
+    ('tags', models.MetadefTag),
+    ('objects', models.MetadefObject),
+    ('properties', models.MetadefProperty),
+    ('resource_type_associations', models.MetadefNamespaceResourceType),
+)
+
+
+def _delete_content_in_batches(model, namespace_id, batch_size, session):
+    """Delete the rows of a namespace, batch_size rows per transaction"""
+    count = 0
+    while True:
+        with session.begin():
+            ids = [row_id for (row_id,) in
+                   session.query(model.id)
+                   .filter(model.namespace_id == namespace_id)
+                   .limit(batch_size)]
+            if not ids:
+                return count
+            count += (session.query(model)
+                      .filter(model.id.in_(ids))
+                      .delete(synchronize_session=False))
+
+
+def delete_cascade_bulk(context, name, session, batch_size=None):
+    """Delete a namespace and its content with direct DELETE statements.
+
+    The content is deleted with one DELETE ... WHERE namespace_id=? per
+    table, without loading it into the session first, and together with
+    the namespace in a single transaction. Raise if not found, has
+    references or not visible.
+
+    :param batch_size: if set, tags, objects and properties are deleted at
+                       most this many rows per transaction, so that huge
+                       namespaces don't hold their locks for long. If this
+                       is interrupted, the namespace is left partially
+                       emptied and the call can be repeated.
+    :returns: the deleted namespace dict and a dict of the number of
+              deleted rows by content type
+    """
 
     namespace_rec = _get_by_name(context, name, session)
-    with session.begin():
-        try:
-            metadef_api.tag.delete_namespace_content(
-                context, namespace_rec.id, session)
-            metadef_api.object.delete_namespace_content(
-                context, namespace_rec.id, session)
-            metadef_api.property.delete_namespace_content(
-                context, namespace_rec.id, session)
-            metadef_api.resource_type_association.delete_namespace_content(
-                context, namespace_rec.id, session)
-            session.delete(namespace_rec)
-            session.flush()
-        except db_exc.DBError as e:
-            if isinstance(e.inner_exception, sa_exc.IntegrityError):
-                LOG.debug("Metadata definition namespace=%s not deleted. "
-                          "Other records still refer to it.", name)
-                raise exc.MetadefIntegrityError(
-                    record_type='namespace', record_name=name)
-            else:
-                raise
+    namespace_id = namespace_rec.id
+    counts = {}
 
-    return namespace_rec.to_dict()
+    try:
+        if batch_size:
+            for key, model in _CONTENT_MODELS:
+                # associations have no id and are few per namespace
+                if model is not models.MetadefNamespaceResourceType:
+                    counts[key] = _delete_content_in_batches(
+                        model, namespace_id, batch_size, session)
+
+        with session.begin():
+            for key, model in _CONTENT_MODELS:
+                deleted = (session.query(model)
+                           .filter(model.namespace_id == namespace_id)
+                           .delete(synchronize_session=False))
+                counts[key] = counts.get(key, 0) + deleted
+            (session.query(models.MetadefNamespace)
+             .filter(models.MetadefNamespace.id == namespace_id)
+             .delete(synchronize_session=False))
+    except db_exc.DBError as e:
+        if isinstance(e.inner_exception, sa_exc.IntegrityError):
+            LOG.debug("Metadata definition namespace=%s not deleted. "
+                      "Other records still refer to it.", name)
+            raise exc.MetadefIntegrityError(
+                record_type='namespace', record_name=name)
+        else:
+            raise
+    finally:
+        metadef_cache.get_namespace_cache().invalidate(
+            name=name, namespace_id=namespace_id)
+
+    session.expunge(namespace_rec)
+    return namespace_rec.to_dict(), counts
+
+
+def delete_cascade(context, name, session):
+    """Raise if not found, has references or not visible"""
+
+    return delete_cascade_bulk(context, name, session)[0]
@@ -6,6 +6,8 @@
 from oslo_db import exception as db_exc
 from oslo_log import log as logging
 from sqlalchemy import func
+from sqlalchemy import lambda_stmt
+from sqlalchemy import select
 import sqlalchemy.orm as sa_orm
 
 from titicaca.common import exception as exc
@@ -19,8 +21,9 @@ LOG = logging.getLogger(__name__)
 
 def _get(context, object_id, session):
     try:
-        query = session.query(models.MetadefObject).filter_by(id=object_id)
-        metadef_object = query.one()
+        stmt = lambda_stmt(lambda: select(models.MetadefObject).where(
+            models.MetadefObject.id == object_id))
+        metadef_object = session.execute(stmt).scalar_one()
     except sa_orm.exc.NoResultFound:
         msg = (_("Metadata definition object not found for id=%s")
                % object_id)
@@ -30,12 +33,15 @@ def _get(context, object_id, session):
     return metadef_object
 
 
-def _get_by_name(context, namespace_name, name, session):
-    namespace = namespace_api.get(context, namespace_name, session)
+def _get_by_name(context, namespace_name, name, session, cached=True):
+    namespace = namespace_api.get_ref(context, namespace_name, session,
+                                      cached=cached)
+    namespace_id = namespace['id']
     try:
-        query = session.query(models.MetadefObject).filter_by(
-            name=name, namespace_id=namespace['id'])
-        metadef_object = query.one()
+        stmt = lambda_stmt(lambda: select(models.MetadefObject).where(
+            models.MetadefObject.namespace_id == namespace_id,
+            models.MetadefObject.name == name))
+        metadef_object = session.execute(stmt).scalar_one()
     except sa_orm.exc.NoResultFound:
         LOG.debug("The metadata definition object with name=%(name)s"
                   " was not found in namespace=%(namespace_name)s.",
@@ -46,20 +52,43 @@ def _get_by_name(context, namespace_name, name, session):
     return metadef_object
 
 
-def get_all(context, namespace_name, session):
-    namespace = namespace_api.get(context, namespace_name, session)
-    query = session.query(models.MetadefObject).filter_by(
-        namespace_id=namespace['id'])
-    md_objects = query.all()
-
-    md_objects_list = []
-    for obj in md_objects:
-        md_objects_list.append(obj.to_dict())
-    return md_objects_list
+def get_all(context, namespace_name, session, marker=None, limit=None,
+            sort_key='created_at', sort_dir='desc', fields=None):
+    """Get the objects of a namespace, paginated if marker or limit is set.
+
+    :param marker: cursor made by metadef_api.utils.make_cursor, or the
+                   object id after which to start page
+    :param limit: maximum number of objects to return
+    :param sort_key: object attribute by which results should be sorted
+    :param sort_dir: direction in which results should be sorted (asc, desc)
+    :param fields: names of the object attributes to return, all of them if
+                   None. The id and sort keys are always returned.
+    """
+    sort_keys = metadef_utils.get_sort_keys(sort_key)
+    if fields is not None:
+        fields = set(fields).union(['id'], sort_keys)
+
+    namespace = namespace_api.get_ref(context, namespace_name, session)
+    columns = models.MetadefObject.dict_columns(fields)
+    query = session.query(*columns).filter_by(namespace_id=namespace['id'])
+
+    if marker is not None or limit is not None:
+        marker_values = None
+        if marker is not None:
+            marker_values = metadef_utils.decode_cursor(
+                marker, sort_keys, sort_dir)
+            if marker_values is None:
+                marker_object = _get(context, marker, session)
+                marker_values = dict((key, getattr(marker_object, key))
+                                     for key in sort_keys)
+        query = metadef_utils.paginate(query, models.MetadefObject, limit,
+                                       sort_keys, sort_dir, marker_values)
+    return models.MetadefObject.rows_to_dicts(query.all(), fields)
 
 
 def create(context, namespace_name, values, session):
-    namespace = namespace_api.get(context, namespace_name, session)
+    namespace = namespace_api.get_ref(context, namespace_name, session,
+                                      cached=False)
     values.update({'namespace_id': namespace['id']})
 
     md_object = models.MetadefObject()
@@ -86,7 +115,7 @@ def get(context, namespace_name, name, session):
 
 def update(context, namespace_name, object_id, values, session):
     """Update an object, raise if ns not found/visible or duplicate result"""
-    namespace_api.get(context, namespace_name, session)
+    namespace_api.get_ref(context, namespace_name, session, cached=False)
 
     md_object = _get(context, object_id, session)
     metadef_utils.drop_protected_attrs(models.MetadefObject, values)
@@ -109,8 +138,8 @@ def update(context, namespace_name, object_id, values, session):
 
 
 def delete(context, namespace_name, object_name, session):
-    namespace_api.get(context, namespace_name, session)
-    md_object = _get_by_name(context, namespace_name, object_name, session)
+    md_object = _get_by_name(context, namespace_name, object_name, session,
+                             cached=False)
 
     session.delete(md_object)
     session.flush()
@@ -129,14 +158,17 @@ def delete_namespace_content(context, namespace_id, session):
 
 
 def delete_by_namespace_name(context, namespace_name, session):
-    namespace = namespace_api.get(context, namespace_name, session)
+    namespace = namespace_api.get_ref(context, namespace_name, session,
+                                      cached=False)
     return delete_namespace_content(context, namespace['id'], session)
 
 
 def count(context, namespace_name, session):
     """Get the count of objects for a namespace, raise if ns not found"""
-    namespace = namespace_api.get(context, namespace_name, session)
+    namespace_id = namespace_api.get_ref(
+        context, namespace_name, session)['id']
 
-    query = session.query(func.count(models.MetadefObject.id)).filter_by(
-        namespace_id=namespace['id'])
-    return query.scalar()
+    stmt = lambda_stmt(lambda: select(
+        func.count(models.MetadefObject.id)).where(
+            models.MetadefObject.namespace_id == namespace_id))
+    return session.execute(stmt).scalar()
@@ -6,6 +6,8 @@
 from oslo_db import exception as db_exc
 from oslo_log import log as logging
 from sqlalchemy import func
+from sqlalchemy import lambda_stmt
+from sqlalchemy import select
 import sqlalchemy.orm as sa_orm
 
 from titicaca.common import exception as exc
@@ -20,8 +22,9 @@ LOG = logging.getLogger(__name__)
 def _get(context, property_id, session):
 
     try:
-        query = session.query(models.MetadefProperty).filter_by(id=property_id)
-        property_rec = query.one()
+        stmt = lambda_stmt(lambda: select(models.MetadefProperty).where(
+            models.MetadefProperty.id == property_id))
+        property_rec = session.execute(stmt).scalar_one()
 
     except sa_orm.exc.NoResultFound:
         msg = (_("Metadata definition property not found for id=%s")
@@ -32,14 +35,17 @@ def _get(context, property_id, session):
     return property_rec
 
 
-def _get_by_name(context, namespace_name, name, session):
+def _get_by_name(context, namespace_name, name, session, cached=True):
     """get a property; raise if ns not found/visible or property not found"""
 
-    namespace = namespace_api.get(context, namespace_name, session)
+    namespace = namespace_api.get_ref(context, namespace_name, session,
+                                      cached=cached)
+    namespace_id = namespace['id']
     try:
-        query = session.query(models.MetadefProperty).filter_by(
-            name=name, namespace_id=namespace['id'])
-        property_rec = query.one()
+        stmt = lambda_stmt(lambda: select(models.MetadefProperty).where(
+            models.MetadefProperty.namespace_id == namespace_id,
+            models.MetadefProperty.name == name))
+        property_rec = session.execute(stmt).scalar_one()
 
     except sa_orm.exc.NoResultFound:
         LOG.debug("The metadata definition property with name=%(name)s"
@@ -58,20 +64,43 @@ def get(context, namespace_name, name, session):
     return property_rec.to_dict()
 
 
-def get_all(context, namespace_name, session):
-    namespace = namespace_api.get(context, namespace_name, session)
-    query = session.query(models.MetadefProperty).filter_by(
-        namespace_id=namespace['id'])
-    properties = query.all()
-
-    properties_list = []
-    for prop in properties:
-        properties_list.append(prop.to_dict())
-    return properties_list
+def get_all(context, namespace_name, session, marker=None, limit=None,
+            sort_key='created_at', sort_dir='desc', fields=None):
+    """Get the properties of a namespace, paginated if marker or limit is set.
+
+    :param marker: cursor made by metadef_api.utils.make_cursor, or the
+                   property id after which to start page
+    :param limit: maximum number of properties to return
+    :param sort_key: property attribute by which results should be sorted
+    :param sort_dir: direction in which results should be sorted (asc, desc)
+    :param fields: names of the property attributes to return, all of them if
+                   None. The id and sort keys are always returned.
+    """
+    sort_keys = metadef_utils.get_sort_keys(sort_key)
+    if fields is not None:
+        fields = set(fields).union(['id'], sort_keys)
+
+    namespace = namespace_api.get_ref(context, namespace_name, session)
+    columns = models.MetadefProperty.dict_columns(fields)
+    query = session.query(*columns).filter_by(namespace_id=namespace['id'])
+
+    if marker is not None or limit is not None:
+        marker_values = None
+        if marker is not None:
+            marker_values = metadef_utils.decode_cursor(
+                marker, sort_keys, sort_dir)
+            if marker_values is None:
+                marker_property = _get(context, marker, session)
+                marker_values = dict((key, getattr(marker_property, key))
+                                     for key in sort_keys)
+        query = metadef_utils.paginate(query, models.MetadefProperty, limit,
+                                       sort_keys, sort_dir, marker_values)
+    return models.MetadefProperty.rows_to_dicts(query.all(), fields)
 
 
 def create(context, namespace_name, values, session):
-    namespace = namespace_api.get(context, namespace_name, session)
+    namespace = namespace_api.get_ref(context, namespace_name, session,
+                                      cached=False)
     values.update({'namespace_id': namespace['id']})
 
     property_rec = models.MetadefProperty()
@@ -96,7 +125,7 @@ def create(context, namespace_name, values, session):
 def update(context, namespace_name, property_id, values, session):
     """Update a property, raise if ns not found/visible or duplicate result"""
 
-    namespace_api.get(context, namespace_name, session)
+    namespace_api.get_ref(context, namespace_name, session, cached=False)
     property_rec = _get(context, property_id, session)
     metadef_utils.drop_protected_attrs(models.MetadefProperty, values)
     # values['updated_at'] = timeutils.utcnow() - done by TS mixin
@@ -121,7 +150,7 @@ def update(context, namespace_name, property_id, values, session):
 
 def delete(context, namespace_name, property_name, session):
     property_rec = _get_by_name(
-        context, namespace_name, property_name, session)
+        context, namespace_name, property_name, session, cached=False)
     if property_rec:
         session.delete(property_rec)
         session.flush()
@@ -140,15 +169,18 @@ def delete_namespace_content(context, namespace_id, session):
 
 
 def delete_by_namespace_name(context, namespace_name, session):
-    namespace = namespace_api.get(context, namespace_name, session)
+    namespace = namespace_api.get_ref(context, namespace_name, session,
+                                      cached=False)
     return delete_namespace_content(context, namespace['id'], session)
 
 
 def count(context, namespace_name, session):
     """Get the count of properties for a namespace, raise if ns not found"""
 
-    namespace = namespace_api.get(context, namespace_name, session)
+    namespace_id = namespace_api.get_ref(
+        context, namespace_name, session)['id']
 
-    query = session.query(func.count(models.MetadefProperty.id)).filter_by(
-        namespace_id=namespace['id'])
-    return query.scalar()
+    stmt = lambda_stmt(lambda: select(
+        func.count(models.MetadefProperty.id)).where(
+            models.MetadefProperty.namespace_id == namespace_id))
+    return session.execute(stmt).scalar()
@@ -6,17 +6,19 @@
 from oslo_db import exception as db_exc
 from oslo_log import log as logging
 import sqlalchemy.exc as sa_exc
+from sqlalchemy import func
 import sqlalchemy.orm as sa_orm
 
 from titicaca.common import exception as exc
+from titicaca.db.sqlalchemy.metadef_api import cache as metadef_cache
 import titicaca.db.sqlalchemy.metadef_api.utils as metadef_utils
 from titicaca.db.sqlalchemy import models_metadef as models
 
 LOG = logging.getLogger(__name__)
 
 
-def get(context, name, session):
-    """Get a resource type, raise if not found"""
+def _get(context, name, session):
+    """Get a resource type model, raise if not found"""
 
     try:
         query = session.query(models.MetadefResourceType).filter_by(name=name)
@@ -26,20 +28,60 @@ def get(context, name, session):
                   name)
         raise exc.MetadefResourceTypeNotFound(resource_type_name=name)
 
-    return resource_type.to_dict()
+    return resource_type
 
 
-def get_all(context, session):
-    """Get a list of all resource types"""
+def _get_version(session):
+    """Return a value that changes whenever the resource types do.
+
+    The id sum tells a deletion followed by a creation apart even when
+    both happen within the resolution of the timestamp columns.
+    """
+
+    model = models.MetadefResourceType
+    return tuple(session.query(func.count(model.id),
+                               func.sum(model.id),
+                               func.max(model.created_at),
+                               func.max(model.updated_at)).one())
+
+
+def _get_all_by_name(session):
+    """Return all resource type dicts by name, through the cache."""
+
+    cache = metadef_cache.get_resource_type_cache()
+    by_name = cache.get()
+    if by_name is not None:
+        return by_name
 
-    query = session.query(models.MetadefResourceType)
-    resource_types = query.all()
+    version = _get_version(session)
+    by_name = cache.get_if_version(version)
+    if by_name is None:
+        rows = session.query(
+            *models.MetadefResourceType.dict_columns()).all()
+        by_name = {rt['name']: rt
+                   for rt in models.MetadefResourceType.rows_to_dicts(rows)}
+        cache.put(version, by_name)
+    return by_name
 
-    resource_types_list = []
-    for rt in resource_types:
-        resource_types_list.append(rt.to_dict())
 
-    return resource_types_list
+def get(context, name, session):
+    """Get a resource type, raise if not found"""
+
+    resource_type = _get_all_by_name(session).get(name)
+    if resource_type is None:
+        # NOTE: The cached map may predate a resource type created by
+        # another worker, confirm the miss against the database.
+        db_rec = _get(context, name, session)
+        metadef_cache.get_resource_type_cache().invalidate()
+        return db_rec.to_dict()
+
+    return dict(resource_type)
+
+
+def get_all(context, session):
+    """Get a list of all resource types"""
+
+    return [dict(rt) for rt in _get_all_by_name(session).values()]
 
 
 def create(context, values, session):
@@ -57,6 +99,7 @@ def create(context, values, session):
         raise exc.MetadefDuplicateResourceType(
             resource_type_name=resource_type.name)
 
+    metadef_cache.get_resource_type_cache().invalidate()
     return resource_type.to_dict()
 
 
@@ -65,17 +108,19 @@ def update(context, values, session):
 
     name = values['name']
     metadef_utils.drop_protected_attrs(models.MetadefResourceType, values)
-    db_rec = get(context, name, session)
+    db_rec = _get(context, name, session)
     db_rec.update(values.copy())
     db_rec.save(session=session)
 
+    metadef_cache.get_resource_type_cache().invalidate()
+
     return db_rec.to_dict()
 
 
 def delete(context, name, session):
     """Delete a resource type or raise if not found or is protected"""
 
-    db_rec = get(context, name, session)
+    db_rec = _get(context, name, session)
     if db_rec.protected is True:
         LOG.debug("Delete forbidden. Metadata definition resource-type %s is a"
                   " seeded-system type and can not be deleted.", name)
@@ -94,4 +139,5 @@ def delete(context, name, session):
         else:
             raise
 
+    metadef_cache.get_resource_type_cache().invalidate()
     return db_rec.to_dict()
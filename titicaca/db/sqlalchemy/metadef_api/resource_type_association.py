@@ -106,7 +106,7 @@ def _delete(context, namespace_name, resource_type_name,
 
 def get(context, namespace_name, resource_type_name, session):
     """Get a resource_type associations; raise if not found"""
-    namespace = namespace_api.get(
+    namespace = namespace_api.get_ref(
         context, namespace_name, session)
 
     resource_type = resource_type_api.get(
@@ -122,7 +122,7 @@ def get_all_by_namespace(context, namespace_name, session):
     """List resource_type associations by namespace, raise if not found"""
 
     # namespace get raises an exception if not visible
-    namespace = namespace_api.get(
+    namespace = namespace_api.get_ref(
         context, namespace_name, session)
 
     db_recs = (
@@ -148,8 +148,8 @@ def get_all_by_namespace(context, namespace_name, session):
 def create(context, namespace_name, values, session):
     """Create an association, raise if already exists or ns not found."""
 
-    namespace = namespace_api.get(
-        context, namespace_name, session)
+    namespace = namespace_api.get_ref(
+        context, namespace_name, session, cached=False)
 
     # if the resource_type does not exist, create it
     resource_type_name = values['name']
@@ -164,8 +164,14 @@ def create(context, namespace_name, values, session):
 
     if resource_type is None:
         resource_type_dict = {'name': resource_type_name, 'protected': False}
-        resource_type = resource_type_api.create(
-            context, resource_type_dict, session)
+        try:
+            with session.begin_nested():
+                resource_type = resource_type_api.create(
+                    context, resource_type_dict, session)
+        except exc.MetadefDuplicateResourceType:
+            # Another worker created it since the lookup
+            resource_type = resource_type_api.get(
+                context, resource_type_name, session)
 
     # Create the association record, set the field values
     ns_resource_type_dict = _to_db_dict(
@@ -179,8 +185,8 @@ def create(context, namespace_name, values, session):
 def delete(context, namespace_name, resource_type_name, session):
     """Delete an association or raise if not found"""
 
-    namespace = namespace_api.get(
-        context, namespace_name, session)
+    namespace = namespace_api.get_ref(
+        context, namespace_name, session, cached=False)
 
     resource_type = resource_type_api.get(
         context, resource_type_name, session)
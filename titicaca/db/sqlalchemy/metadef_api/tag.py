@@ -4,37 +4,42 @@
 
 
 from oslo_db import exception as db_exc
-from oslo_db.sqlalchemy.utils import paginate_query
 from oslo_log import log as logging
 from sqlalchemy import func
+from sqlalchemy import lambda_stmt
+from sqlalchemy import select
 import sqlalchemy.orm as sa_orm
 
 from titicaca.common import exception as exc
 from titicaca.db.sqlalchemy.metadef_api import namespace as namespace_api
 import titicaca.db.sqlalchemy.metadef_api.utils as metadef_utils
 from titicaca.db.sqlalchemy import models_metadef as models
-from titicaca.i18n import _LW
+from titicaca.i18n import _
 
 LOG = logging.getLogger(__name__)
 
 
 def _get(context, id, session):
     try:
-        query = (session.query(models.MetadefTag).filter_by(id=id))
-        metadef_tag = query.one()
+        stmt = lambda_stmt(lambda: select(models.MetadefTag).where(
+            models.MetadefTag.id == id))
+        metadef_tag = session.execute(stmt).scalar_one()
     except sa_orm.exc.NoResultFound:
-        msg = (_LW("Metadata tag not found for id %s") % id)
+        msg = (_("Metadata tag not found for id %s") % id)
         LOG.warning(msg)
         raise exc.MetadefTagNotFound(message=msg)
     return metadef_tag
 
 
-def _get_by_name(context, namespace_name, name, session):
-    namespace = namespace_api.get(context, namespace_name, session)
+def _get_by_name(context, namespace_name, name, session, cached=True):
+    namespace = namespace_api.get_ref(context, namespace_name, session,
+                                      cached=cached)
+    namespace_id = namespace['id']
     try:
-        query = (session.query(models.MetadefTag).filter_by(
-            name=name, namespace_id=namespace['id']))
-        metadef_tag = query.one()
+        stmt = lambda_stmt(lambda: select(models.MetadefTag).where(
+            models.MetadefTag.namespace_id == namespace_id,
+            models.MetadefTag.name == name))
+        metadef_tag = session.execute(stmt).scalar_one()
     except sa_orm.exc.NoResultFound:
         LOG.debug("The metadata tag with name=%(name)s"
                   " was not found in namespace=%(namespace_name)s.",
@@ -49,38 +54,37 @@ def get_all(context, namespace_name, session, filters=None, marker=None,
     """Get all tags that match zero or more filters.
 
     :param filters: dict of filter keys and values.
-    :param marker: tag id after which to start page
+    :param marker: cursor made by metadef_api.utils.make_cursor, or the
+                   tag id after which to start page
     :param limit: maximum number of namespaces to return
     :param sort_key: namespace attribute by which results should be sorted
     :param sort_dir: direction in which results should be sorted (asc, desc)
     """
 
-    namespace = namespace_api.get(context, namespace_name, session)
+    namespace = namespace_api.get_ref(context, namespace_name, session)
     query = (session.query(models.MetadefTag).filter_by(
         namespace_id=namespace['id']))
 
-    marker_tag = None
+    sort_keys = metadef_utils.get_sort_keys(sort_key)
+    marker_values = None
     if marker is not None:
-        marker_tag = _get(context, marker, session)
+        marker_values = metadef_utils.decode_cursor(
+            marker, sort_keys, sort_dir)
+        if marker_values is None:
+            marker_tag = _get(context, marker, session)
+            marker_values = dict((key, getattr(marker_tag, key))
+                                 for key in sort_keys)
 
-    sort_keys = ['created_at', 'id']
-    sort_keys.insert(0, sort_key) if sort_key not in sort_keys else sort_keys
+    query = query.with_entities(*models.MetadefTag.dict_columns())
+    query = metadef_utils.paginate(query, models.MetadefTag, limit,
+                                   sort_keys, sort_dir, marker_values)
 
-    query = paginate_query(query=query,
-                           model=models.MetadefTag,
-                           limit=limit,
-                           sort_keys=sort_keys,
-                           marker=marker_tag, sort_dir=sort_dir)
-    metadef_tag = query.all()
-    metadef_tag_list = []
-    for tag in metadef_tag:
-        metadef_tag_list.append(tag.to_dict())
-
-    return metadef_tag_list
+    return models.MetadefTag.rows_to_dicts(query.all())
 
 
 def create(context, namespace_name, values, session):
-    namespace = namespace_api.get(context, namespace_name, session)
+    namespace = namespace_api.get_ref(context, namespace_name, session,
+                                      cached=False)
     values.update({'namespace_id': namespace['id']})
 
     metadef_tag = models.MetadefTag()
@@ -105,29 +109,64 @@ def create_tags(context, namespace_name, tag_list, can_append, session):
 
     metadef_tags_list = []
     if tag_list:
-        namespace = namespace_api.get(context, namespace_name, session)
+        namespace = namespace_api.get_ref(context, namespace_name, session,
+                                          cached=False)
+        namespace_id = namespace['id']
+
+        tag_values = []
+        for value in tag_list:
+            value.update({'namespace_id': namespace_id})
+            metadef_utils.drop_protected_attrs(models.MetadefTag, value)
+            tag_values.append(value.copy())
 
         try:
             with session.begin():
                 if not can_append:
                     query = (session.query(models.MetadefTag).filter_by(
-                             namespace_id=namespace['id']))
-                    query.delete(synchronize_session='fetch')
-                for value in tag_list:
-                    value.update({'namespace_id': namespace['id']})
-                    metadef_utils.drop_protected_attrs(
-                        models.MetadefTag, value)
-                    metadef_tag = models.MetadefTag()
-                    metadef_tag.update(value.copy())
-                    metadef_tag.save(session=session)
-                    metadef_tags_list.append(metadef_tag.to_dict())
-        except db_exc.DBDuplicateEntry:
+                             namespace_id=namespace_id))
+                    query.delete(synchronize_session=False)
+                    existing_names = set()
+                else:
+                    query = (session.query(models.MetadefTag.name).filter(
+                             models.MetadefTag.namespace_id == namespace_id,
+                             models.MetadefTag.name.in_(
+                                 set(value.get('name')
+                                     for value in tag_values))))
+                    existing_names = set(name for name, in query)
+
+                # NOTE: Duplicates are detected up front, against the
+                # namespace content and within the list itself, so the
+                # tags can be written with a single multi-row insert.
+                new_names = set()
+                for value in tag_values:
+                    name = value.get('name')
+                    if name in existing_names or name in new_names:
+                        LOG.debug("A metadata tag name=%(name)s"
+                                  " in namespace=%(namespace_name)s"
+                                  " already exists.",
+                                  {'name': name,
+                                   'namespace_name': namespace_name})
+                        raise exc.MetadefDuplicateTag(
+                            name=name, namespace_name=namespace_name)
+                    new_names.add(name)
+
+                session.bulk_insert_mappings(models.MetadefTag, tag_values)
+
+                query = (session.query(models.MetadefTag).filter(
+                         models.MetadefTag.namespace_id == namespace_id,
+                         models.MetadefTag.name.in_(new_names)))
+                created = dict((tag.name, tag.to_dict()) for tag in query)
+                metadef_tags_list = [created[value['name']]
+                                     for value in tag_values]
+        except db_exc.DBDuplicateEntry as e:
+            # Names differing only by case collide on case insensitive
+            # collations without being caught by the pre-check.
+            name = getattr(e, 'value', None) or tag_values[0].get('name')
             LOG.debug("A metadata tag name=%(name)s"
                       " in namespace=%(namespace_name)s already exists.",
-                      {'name': metadef_tag.name,
-                       'namespace_name': namespace_name})
+                      {'name': name, 'namespace_name': namespace_name})
             raise exc.MetadefDuplicateTag(
-                name=metadef_tag.name, namespace_name=namespace_name)
+                name=name, namespace_name=namespace_name)
 
     return metadef_tags_list
 
@@ -139,7 +178,7 @@ def get(context, namespace_name, name, session):
 
 def update(context, namespace_name, id, values, session):
     """Update an tag, raise if ns not found/visible or duplicate result"""
-    namespace_api.get(context, namespace_name, session)
+    namespace_api.get_ref(context, namespace_name, session, cached=False)
 
     metadata_tag = _get(context, id, session)
     metadef_utils.drop_protected_attrs(models.MetadefTag, values)
@@ -160,8 +199,8 @@ def update(context, namespace_name, id, values, session):
 
 
 def delete(context, namespace_name, name, session):
-    namespace_api.get(context, namespace_name, session)
-    md_tag = _get_by_name(context, namespace_name, name, session)
+    md_tag = _get_by_name(context, namespace_name, name, session,
+                          cached=False)
 
     session.delete(md_tag)
     session.flush()
@@ -179,13 +218,16 @@ def delete_namespace_content(context, namespace_id, session):
 
 
 def delete_by_namespace_name(context, namespace_name, session):
-    namespace = namespace_api.get(context, namespace_name, session)
+    namespace = namespace_api.get_ref(context, namespace_name, session,
+                                      cached=False)
     return delete_namespace_content(context, namespace['id'], session)
 
 
 def count(context, namespace_name, session):
     """Get the count of objects for a namespace, raise if ns not found"""
-    namespace = namespace_api.get(context, namespace_name, session)
-    query = (session.query(func.count(models.MetadefTag.id)).filter_by(
-        namespace_id=namespace['id']))
-    return query.scalar()
+    namespace_id = namespace_api.get_ref(
+        context, namespace_name, session)['id']
+    stmt = lambda_stmt(lambda: select(
+        func.count(models.MetadefTag.id)).where(
+            models.MetadefTag.namespace_id == namespace_id))
+    return session.execute(stmt).scalar()
@@ -2,6 +2,20 @@
 # Copyright (c) 2023 WenRui Gong
 # All rights reserved.
 
+import base64
+import datetime
+import json
+import types
+
+from oslo_db import exception as db_exc
+from oslo_db.sqlalchemy.utils import paginate_query
+import sqlalchemy
+
+from titicaca.common import exception as exc
+from titicaca.i18n import _
+
+CURSOR_PREFIX = 'k1.'
+
 
 def drop_protected_attrs(model_class, values):
     """
@@ -11,3 +25,114 @@ def drop_protected_attrs(model_class, values):
     for attr in model_class.__protected_attributes__:
         if attr in values:
             del values[attr]
+
+
+def get_sort_keys(sort_key):
+    """Return the full sort key list, made unique by created_at and id."""
+    sort_keys = ['created_at', 'id']
+    if sort_key is not None and sort_key not in sort_keys:
+        sort_keys.insert(0, sort_key)
+    return sort_keys
+
+
+def _encode_cursor_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_cursor_value(value):
+    if isinstance(value, dict):
+        return datetime.datetime.fromisoformat(value['dt'])
+    return value
+
+
+def make_cursor(record, sort_key='created_at', sort_dir='desc'):
+    """Return an opaque marker pointing right after record.
+
+    The marker encodes the sort key values of the record, so the next
+    page can be fetched with a single index range scan and without
+    looking the marker row up again.
+
+    :param record: dict of the last row of a page, as returned by get_all
+    :param sort_key: sort key the page was fetched with
+    :param sort_dir: sort direction the page was fetched with
+    """
+    sort_keys = get_sort_keys(sort_key)
+    values = [_encode_cursor_value(record[key]) for key in sort_keys]
+    payload = json.dumps([sort_keys, sort_dir, values],
+                         separators=(',', ':'))
+    return CURSOR_PREFIX + base64.urlsafe_b64encode(
+        payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(marker, sort_keys, sort_dir):
+    """Return the sort key values encoded in a marker made by make_cursor.
+
+    :returns: dict of sort key values, or None if marker is not a cursor
+              (e.g. a legacy marker holding a row id)
+    :raises titicaca.common.exception.Invalid: if the cursor is malformed
+            or was made for another sort order
+    """
+    if not isinstance(marker, str) or not marker.startswith(CURSOR_PREFIX):
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(
+            marker[len(CURSOR_PREFIX):].encode('ascii'))
+        keys, direction, values = json.loads(payload)
+        values = [_decode_cursor_value(value) for value in values]
+    except (ValueError, TypeError, KeyError):
+        raise exc.Invalid(_("Invalid pagination marker %s") % marker)
+    if (keys != sort_keys or direction != sort_dir or
+            len(values) != len(keys)):
+        raise exc.Invalid(_("Pagination marker %s does not match the "
+                            "requested sort order") % marker)
+    return dict(zip(keys, values))
+
+
+def paginate(query, model, limit, sort_keys, sort_dir, marker_values=None):
+    """Return a query paginated by keyset over sort_keys.
+
+    Unlike oslo's paginate_query, the page boundary is expressed as a
+    single row value comparison, e.g. (name, created_at, id) > (?, ?, ?),
+    which databases resolve with one index range scan. Sorting on
+    nullable columns falls back to paginate_query, which knows how to
+    order NULLs, still without fetching the marker row.
+
+    :param marker_values: dict of sort key values of the last row of the
+                          previous page, or None for the first page
+    """
+    if sort_dir not in ('asc', 'desc'):
+        raise ValueError(_("Unknown sort direction, must be 'desc' or "
+                           "'asc'"))
+
+    table_columns = model.__table__.columns
+    columns = []
+    for key in sort_keys:
+        if key not in table_columns:
+            raise db_exc.InvalidSortKey(key=key)
+        columns.append(getattr(model, key))
+
+    if (any(table_columns[key].nullable for key in sort_keys) or
+            (marker_values is not None and
+             None in marker_values.values())):
+        marker = None
+        if marker_values is not None:
+            marker = types.SimpleNamespace(**marker_values)
+        return paginate_query(query=query, model=model, limit=limit,
+                              sort_keys=sort_keys, marker=marker,
+                              sort_dir=sort_dir)
+
+    if marker_values is not None:
+        row = sqlalchemy.tuple_(*columns)
+        bound = sqlalchemy.tuple_(*[marker_values[key] for key in sort_keys])
+        query = query.filter(row < bound if sort_dir == 'desc'
+                             else row > bound)
+
+    if sort_dir == 'desc':
+        query = query.order_by(*[column.desc() for column in columns])
+    else:
+        query = query.order_by(*[column.asc() for column in columns])
+    if limit is not None:
+        query = query.limit(limit)
+    return query
@@ -8,6 +8,7 @@
 SQLAlchemy models for titicaca data
 """
 
+import json
 import uuid
 
 from oslo_db.sqlalchemy import models
@@ -34,14 +35,28 @@ from titicaca.common import timeutils
 BASE = declarative_base()
 
 
+_JSON_ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+
+def _encode_json(value):
+    # NOTE: The C encoder with compact separators and no key sorting is
+    # the fast path; values it can't handle (datetimes, ...) go through
+    # oslo's to_primitive conversion as before.
+    try:
+        return _JSON_ENCODER.encode(value)
+    except TypeError:
+        return jsonutils.dumps(value)
+
+
 class JSONEncodedDict(TypeDecorator):
     """Represents an immutable structure as a json-encoded string"""
 
     impl = Text
+    cache_ok = True
 
     def process_bind_param(self, value, dialect):
         if value is not None:
-            value = jsonutils.dumps(value)
+            value = _encode_json(value)
         return value
 
     def process_result_value(self, value, dialect):
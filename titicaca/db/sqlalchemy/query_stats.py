@@ -0,0 +1,213 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+"""
+Lightweight per-request accounting of SQL statements
+
+Engine event listeners count the statements run, the time spent in the
+database and the rows reported by the driver, per request. Statements
+taking longer than a configurable threshold are logged together with a
+fingerprint, the statement with its literals and parameters normalized,
+so that the same query can be recognized across requests.
+"""
+
+import collections
+import contextlib
+import functools
+import hashlib
+import re
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from sqlalchemy import event
+import webob.dec
+
+from titicaca.common import wsgi
+from titicaca.i18n import _
+
+LOG = logging.getLogger(__name__)
+
+query_stats_opts = [
+    cfg.BoolOpt('db_query_accounting',
+                default=True,
+                help=_("""
+Count SQL statements, database time and rows per request.
+
+The counters are kept in memory for the API request being served and
+logged at info level when it finishes, along with the statement run
+the most times, which points at queries issued in a loop. Requests are
+counted by the querystats filter of the API paste pipeline. The
+overhead is a couple of timer reads per statement.
+
+Possible values:
+    * True
+    * False
+
+Related options:
+    * db_slow_query_threshold
+
+""")),
+    cfg.FloatOpt('db_slow_query_threshold',
+                 default=1.0,
+                 min=0,
+                 help=_("""
+Time in seconds above which a SQL statement is logged as slow.
+
+Slow statements are logged at warning level with their fingerprint:
+the statement text with literals, bound parameters and IN lists
+normalized, and a short hash of it to grep for.
+
+Possible values:
+    * 0 disables the slow query log
+    * Positive number
+
+Related options:
+    * db_query_accounting
+
+""")),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(query_stats_opts)
+
+_LOCAL = threading.local()
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAM_RE = re.compile(r'%\(\w+\)s|%s|(?<!:):\w+|\?')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(statement):
+    """Return statement with its literals and parameters replaced by ?
+
+    Lists of values, like those of IN clauses, collapse into a single ?
+    so that the same query with a different number of values has the
+    same fingerprint.
+    """
+    text = _WHITESPACE_RE.sub(' ', statement.strip())
+    text = _LITERAL_RE.sub('?', text)
+    text = _PARAM_RE.sub('?', text)
+    return _IN_LIST_RE.sub('(?)', text)
+
+
+def fingerprint_id(fingerprint):
+    """Return a short hash identifying a statement fingerprint."""
+    return hashlib.md5(fingerprint.encode('utf-8'),
+                       usedforsecurity=False).hexdigest()[:12]
+
+
+class QueryStats(object):
+    """SQL statement counters of a single request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.rows = 0
+        self.statements = collections.Counter()
+
+    def most_repeated(self):
+        """Return the fingerprint run most often and its count, or None."""
+        if not self.statements:
+            return None
+        return self.statements.most_common(1)[0]
+
+
+def start_request():
+    """Start counting the statements of the current request."""
+    stats = QueryStats()
+    _LOCAL.stats = stats
+    return stats
+
+
+def finish_request():
+    """Stop counting and return the current request's QueryStats."""
+    stats = getattr(_LOCAL, 'stats', None)
+    _LOCAL.stats = None
+    return stats
+
+
+def get_current():
+    """Return the QueryStats of the current request, or None."""
+    return getattr(_LOCAL, 'stats', None)
+
+
+@contextlib.contextmanager
+def request_stats(name):
+    """Count the statements run in the block and log a summary line.
+
+    :param name: what is being served, e.g. the method and path of the
+                 request, used in the log line
+    """
+    stats = start_request()
+    try:
+        yield stats
+    finally:
+        finish_request()
+        repeated = stats.most_repeated()
+        if repeated is not None and repeated[1] > 1:
+            LOG.info("%(name)s: %(count)d SQL statements in %(time).3fs, "
+                     "%(rows)d rows; run %(times)d times: %(statement)s",
+                     {'name': name, 'count': stats.count,
+                      'time': stats.duration, 'rows': stats.rows,
+                      'times': repeated[1], 'statement': repeated[0]})
+        else:
+            LOG.info("%(name)s: %(count)d SQL statements in %(time).3fs, "
+                     "%(rows)d rows",
+                     {'name': name, 'count': stats.count,
+                      'time': stats.duration, 'rows': stats.rows})
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    context._titicaca_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start = getattr(context, '_titicaca_query_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+
+    stats = getattr(_LOCAL, 'stats', None)
+    if stats is not None:
+        stats.count += 1
+        stats.duration += elapsed
+        # NOTE: rowcount is what the driver reports: rows changed for
+        # DML, rows returned by buffered SELECTs and -1 when unknown.
+        if cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+        stats.statements[fingerprint(statement)] += 1
+
+    threshold = CONF.db_slow_query_threshold
+    if threshold and elapsed >= threshold:
+        text = fingerprint(statement)
+        LOG.warning("Slow SQL statement %(id)s took %(time).3fs: %(text)s",
+                    {'id': fingerprint_id(text), 'time': elapsed,
+                     'text': text})
+
+
+def install(engine):
+    """Add the accounting listeners to an engine, once."""
+    if not CONF.db_query_accounting:
+        return
+    if event.contains(engine, 'before_cursor_execute',
+                      _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class QueryStatsMiddleware(wsgi.Middleware):
+    """Count the SQL statements run while serving each API request."""
+
+    @webob.dec.wsgify
+    def __call__(self, req):
+        if not CONF.db_query_accounting:
+            return req.get_response(self.application)
+        with request_stats('%s %s' % (req.method, req.path)):
+            return req.get_response(self.application)
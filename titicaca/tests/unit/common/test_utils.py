@@ -0,0 +1,321 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+import unittest
+
+import webob
+import webob.exc
+
+from titicaca.tests import utils as test_utils
+
+try:
+    from titicaca.common import utils
+except ImportError as e:
+    # NOTE: titicaca.common.utils needs titicaca_store and the image
+    # import flow options of titicaca.async_ to be importable.
+    utils = None
+    UTILS_IMPORT_ERROR = str(e)
+else:
+    UTILS_IMPORT_ERROR = None
+
+
+class FakeHTTPResponse(object):
+    """httplib.HTTPResponse stand-in, as used by the replicator."""
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def getheaders(self):
+        return list(self.headers.items())
+
+
+@unittest.skipIf(utils is None,
+                 'titicaca.common.utils is not importable: %s' %
+                 UTILS_IMPORT_ERROR)
+class TestImageMetaHeaders(test_utils.BaseTestCase):
+
+    INT_FIELDS = ('size', 'min_disk', 'min_ram', 'virtual_size')
+    BOOL_FIELDS = ('is_public', 'deleted', 'protected')
+
+    def _value(self, field):
+        if field in self.INT_FIELDS:
+            return 42
+        if field in self.BOOL_FIELDS:
+            return True
+        return 'value-of-%s' % field
+
+    def _decode(self, headers):
+        response = webob.Response()
+        for key, value in headers.items():
+            response.headers[key] = value
+        result = utils.get_image_meta_from_headers(response)
+        self.assertEqual(result,
+                         utils.get_image_meta_from_headers(
+                             FakeHTTPResponse(headers)))
+        return result
+
+    def test_round_trip_every_header(self):
+        for header in utils.IMAGE_META_HEADERS:
+            field = header[len('x-image-meta-'):]
+            image_meta = {field: self._value(field)}
+
+            headers = utils.image_meta_to_http_headers(image_meta)
+            self.assertEqual({header: str(self._value(field))}, headers)
+            self.assertEqual(dict(image_meta, properties={}),
+                             self._decode(headers))
+
+    def test_round_trip_all_headers_at_once(self):
+        image_meta = dict((header[len('x-image-meta-'):],
+                           self._value(header[len('x-image-meta-'):]))
+                          for header in utils.IMAGE_META_HEADERS)
+        image_meta['properties'] = {'kernel_id': 'k1', 'ramdisk_id': 'r1'}
+
+        headers = utils.image_meta_to_http_headers(image_meta)
+        self.assertEqual(len(utils.IMAGE_META_HEADERS) + 2, len(headers))
+        self.assertEqual(image_meta, self._decode(headers))
+
+    def test_encode_skips_none(self):
+        headers = utils.image_meta_to_http_headers(
+            {'name': None, 'size': 1,
+             'properties': {'a': None, 'b': 'c'}})
+        self.assertEqual({'x-image-meta-size': '1',
+                          'x-image-meta-property-b': 'c'}, headers)
+
+    def test_encode_lowercases_unknown_fields_and_properties(self):
+        headers = utils.image_meta_to_http_headers(
+            {'Other': 'x', 'properties': {'Kernel_ID': 'k1'}})
+        self.assertEqual({'x-image-meta-other': 'x',
+                          'x-image-meta-property-kernel_id': 'k1'},
+                         headers)
+
+    def test_decode_spelling_variants(self):
+        for header in ('x-image-meta-disk_format',
+                       'x-image-meta-disk-format',
+                       'X-Image-Meta-Disk-Format',
+                       'X-IMAGE-META-DISK_FORMAT'):
+            self.assertEqual({'disk_format': 'raw', 'properties': {}},
+                             self._decode({header: 'raw'}))
+
+    def test_decode_mixed_spelling_not_in_table(self):
+        # Known fields are accepted with any mix of '-' and '_'
+        result = self._decode({'x-image-meta-virtual-size': '3',
+                               'x-image-meta-container-format': 'bare'})
+        self.assertEqual({'virtual_size': 3, 'container_format': 'bare',
+                          'properties': {}}, result)
+
+    def test_decode_properties(self):
+        result = self._decode({'x-image-meta-property-kernel-id': 'k1',
+                               'X-Image-Meta-Property-ramdisk_id': 'r1',
+                               'x-image-meta-property-empty': ''})
+        self.assertEqual({'properties': {'kernel_id': 'k1',
+                                         'ramdisk_id': 'r1',
+                                         'empty': None}}, result)
+
+    def test_decode_ignores_other_headers(self):
+        result = self._decode({'Content-Type': 'text/plain',
+                               'x-image-meta-name': 'image'})
+        self.assertEqual({'name': 'image', 'properties': {}}, result)
+
+    def test_decode_empty_value(self):
+        self.assertEqual({'name': None, 'properties': {}},
+                         self._decode({'x-image-meta-name': ''}))
+
+    def test_decode_bad_header(self):
+        for header in ('x-image-meta-bogus', 'x-image-meta-',
+                       'x-image-meta-propertyfoo'):
+            self.assertRaises(webob.exc.HTTPBadRequest, self._decode,
+                              {header: 'x'})
+
+    def test_decode_bad_values(self):
+        for headers in ({'x-image-meta-size': 'big'},
+                        {'x-image-meta-min_ram': '-1'},
+                        {'x-image-meta-size': 'None'}):
+            self.assertRaises(utils.exception.InvalidParameterValue,
+                              self._decode, headers)
+        self.assertEqual({'virtual_size': None, 'properties': {}},
+                         self._decode({'x-image-meta-virtual_size': 'None'}))
+
+
+def _legacy_validate_import_uri(uri, conf):
+    """validate_import_uri as it was before the policy was compiled."""
+    if not uri:
+        return False
+
+    parsed_uri = utils.urllib.parse.urlparse(uri)
+    scheme = parsed_uri.scheme
+    host = parsed_uri.hostname
+    port = parsed_uri.port
+    wl_schemes = conf.allowed_schemes
+    bl_schemes = conf.disallowed_schemes
+    wl_hosts = conf.allowed_hosts
+    bl_hosts = conf.disallowed_hosts
+    wl_ports = conf.allowed_ports
+    bl_ports = conf.disallowed_ports
+
+    if wl_schemes and bl_schemes:
+        bl_schemes = []
+    if wl_hosts and bl_hosts:
+        bl_hosts = []
+    if wl_ports and bl_ports:
+        bl_ports = []
+
+    if not scheme or ((wl_schemes and scheme not in wl_schemes) or
+                      parsed_uri.scheme in bl_schemes):
+        return False
+    if not host or ((wl_hosts and host not in wl_hosts) or
+                    host in bl_hosts):
+        return False
+    if port and ((wl_ports and port not in wl_ports) or
+                 port in bl_ports):
+        return False
+
+    return True
+
+
+@unittest.skipIf(utils is None,
+                 'titicaca.common.utils is not importable: %s' %
+                 UTILS_IMPORT_ERROR)
+class TestImportURIPolicy(test_utils.BaseTestCase):
+
+    URIS = ('', 'http://example.com/image', 'https://example.com/image',
+            'ftp://example.com/image', 'http://example.com:8080/image',
+            'https://example.com:443/image', 'http://other.org/image',
+            'http://10.0.0.5/image', 'http://10.0.0.5:8080/image',
+            'http://[fe80::1]:80/image', 'file:///etc/passwd',
+            'http:///image', 'example.com/image',
+            'http://EXAMPLE.com/image')
+
+    CONFIGS = (
+        {},
+        {'allowed_schemes': ['http', 'https']},
+        {'disallowed_schemes': ['ftp', 'file']},
+        {'allowed_schemes': ['https'], 'disallowed_schemes': ['https']},
+        {'allowed_hosts': ['example.com', '10.0.0.5']},
+        {'disallowed_hosts': ['other.org', 'fe80::1']},
+        {'allowed_hosts': ['example.com'],
+         'disallowed_hosts': ['example.com']},
+        {'allowed_ports': [80, 443]},
+        {'disallowed_ports': [8080]},
+        {'allowed_ports': [8080], 'disallowed_ports': [8080]},
+        {'allowed_schemes': ['http'], 'disallowed_hosts': ['other.org'],
+         'allowed_ports': [80, 8080]},
+    )
+
+    def config(self, group=None, **kw):
+        super(TestImportURIPolicy, self).config(group=group, **kw)
+        # Overrides don't run the config mutate hooks
+        utils.reset_import_uri_policy()
+        self.addCleanup(utils.reset_import_uri_policy)
+
+    def test_same_decisions_as_legacy_function(self):
+        for options in self.CONFIGS:
+            self.config(group='import_filtering_opts',
+                        **dict(dict.fromkeys(
+                            ('allowed_schemes', 'disallowed_schemes',
+                             'allowed_hosts', 'disallowed_hosts',
+                             'allowed_ports', 'disallowed_ports'), []),
+                            **options))
+            opts = utils.CONF.import_filtering_opts
+            for uri in self.URIS:
+                self.assertEqual(_legacy_validate_import_uri(uri, opts),
+                                 utils.validate_import_uri(uri),
+                                 'uri %r with %r' % (uri, options))
+
+    def test_policy_compiled_once(self):
+        policy = utils.get_import_uri_policy()
+        self.assertIs(policy, utils.get_import_uri_policy())
+
+    def test_rebuilt_on_config_reload(self):
+        self.assertIn(utils.reset_import_uri_policy,
+                      utils.CONF._mutate_hooks)
+        self.config(group='import_filtering_opts',
+                    allowed_hosts=['example.com'])
+        self.assertTrue(utils.validate_import_uri('http://example.com/x'))
+        utils.CONF.set_override('allowed_hosts', ['other.org'],
+                                'import_filtering_opts')
+        self.assertTrue(utils.validate_import_uri('http://example.com/x'))
+
+        utils.reset_import_uri_policy()
+        self.assertFalse(utils.validate_import_uri('http://example.com/x'))
+        self.assertTrue(utils.validate_import_uri('http://other.org/x'))
+
+    def test_host_suffix_wildcard(self):
+        self.config(group='import_filtering_opts',
+                    allowed_hosts=['*.example.com'])
+        self.assertTrue(utils.validate_import_uri('http://a.example.com/x'))
+        self.assertTrue(
+            utils.validate_import_uri('http://A.B.Example.com/x'))
+        self.assertFalse(utils.validate_import_uri('http://example.com/x'))
+        self.assertFalse(
+            utils.validate_import_uri('http://badexample.com/x'))
+
+    def test_host_cidr(self):
+        self.config(group='import_filtering_opts',
+                    disallowed_hosts=['10.0.0.0/8', 'fe80::/10'])
+        self.assertFalse(utils.validate_import_uri('http://10.1.2.3/x'))
+        self.assertFalse(utils.validate_import_uri('http://[fe80::1]/x'))
+        self.assertTrue(utils.validate_import_uri('http://11.1.2.3/x'))
+        self.assertTrue(utils.validate_import_uri('http://example.com/x'))
+
+
+@unittest.skipIf(utils is None,
+                 'titicaca.common.utils is not importable: %s' %
+                 UTILS_IMPORT_ERROR)
+class TestNo4ByteParams(test_utils.BaseTestCase):
+
+    EMOJI = '\U0001F600'
+
+    def test_find_clean(self):
+        self.assertIsNone(utils.find_4byte_unicode(
+            {'name': 'ascii', 'description': 'café 中文',
+             'nested': {'a': 1, 'b': None, 'c': ['x']}}))
+
+    def test_find_value_path(self):
+        self.assertEqual((('properties', 'os', 'title'), False),
+                         utils.find_4byte_unicode(
+                             {'name': 'ns',
+                              'properties': {'os': {'title': self.EMOJI}}}))
+
+    def test_find_key_path(self):
+        self.assertEqual((('properties', self.EMOJI), True),
+                         utils.find_4byte_unicode(
+                             {'properties': {self.EMOJI: 'x'}}))
+
+    def test_find_deeply_nested(self):
+        data = value = {}
+        for i in range(10000):
+            value['k'] = {}
+            value = value['k']
+        value['k'] = self.EMOJI
+
+        path, is_key = utils.find_4byte_unicode(data)
+        self.assertEqual(10001, len(path))
+        self.assertFalse(is_key)
+
+    def test_error_reports_value_path(self):
+        with self.assertRaises(utils.exception.Invalid) as cm:
+            utils.check_no_4byte_values(
+                [{'name': 'ok'},
+                 {'properties': {'os': {'title': self.EMOJI}}}])
+        self.assertIn('Title', str(cm.exception))
+        self.assertIn('properties.os.title', str(cm.exception))
+
+    def test_error_reports_key_path(self):
+        with self.assertRaises(utils.exception.Invalid) as cm:
+            utils.check_no_4byte_values([{'properties': {self.EMOJI: 'x'}}])
+        self.assertIn('Property names', str(cm.exception))
+        self.assertIn('properties.%s' % self.EMOJI, str(cm.exception))
+
+    def test_decorator(self):
+        @utils.no_4byte_params
+        def create(context, values, session=None, **kwargs):
+            return values
+
+        self.assertEqual({'name': 'ok'}, create(None, {'name': 'ok'}))
+        self.assertRaises(utils.exception.Invalid, create, None,
+                          {'name': self.EMOJI})
+        self.assertRaises(utils.exception.Invalid, create, None,
+                          {'name': 'ok'}, self.EMOJI)
+        with self.assertRaises(utils.exception.Invalid) as cm:
+            create(None, {'name': 'ok'}, description=self.EMOJI)
+        self.assertIn('description', str(cm.exception))
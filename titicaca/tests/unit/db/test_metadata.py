@@ -0,0 +1,70 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+import json
+import os
+import tarfile
+
+from titicaca.db.sqlalchemy import metadata
+from titicaca.db.sqlalchemy.metadef_api import namespace as namespace_api
+from titicaca.db.sqlalchemy.metadef_api import tag as tag_api
+from titicaca.tests import utils as test_utils
+
+
+class TestExportMetadefs(test_utils.MetadefDBTestCase):
+
+    def setUp(self):
+        super(TestExportMetadefs, self).setUp()
+        self.config(metadata_load_workers=4)
+        context = test_utils.get_context(is_admin=True)
+        session = self.get_session()
+        # All stripped to the same file name, whatever the case
+        self.display_names = {'ns1': 'My Namespace', 'ns2': 'My-Namespace',
+                              'ns3': 'my_namespace', 'ns4': 'Other'}
+        for namespace, display_name in sorted(self.display_names.items()):
+            namespace_api.create(context,
+                                 {'namespace': namespace, 'owner': 'admin',
+                                  'display_name': display_name,
+                                  'visibility': 'public',
+                                  'protected': False},
+                                 session)
+            tag_api.create(context, namespace, {'name': namespace + '_tag'},
+                           session)
+        session.commit()
+        self.export_dir = os.path.join(self.test_dir, 'export') + os.sep
+        os.mkdir(self.export_dir)
+
+    def _assert_documents(self, documents):
+        self.assertEqual({'MyNamespace.json': 'ns1',
+                          'MyNamespace_2.json': 'ns2',
+                          'mynamespace_3.json': 'ns3',
+                          'Other.json': 'ns4'},
+                         dict((name, document['namespace'])
+                              for name, document in documents.items()))
+        for document in documents.values():
+            namespace = document['namespace']
+            self.assertEqual(self.display_names[namespace],
+                             document['display_name'])
+            self.assertEqual([{'name': namespace + '_tag'}],
+                             document['tags'])
+
+    def test_export_colliding_file_names(self):
+        metadata.db_export_metadefs(self.engine, self.export_dir)
+
+        documents = {}
+        for name in os.listdir(self.export_dir):
+            with open(os.path.join(self.export_dir, name)) as json_file:
+                documents[name] = json.load(json_file)
+        self._assert_documents(documents)
+
+    def test_export_archive_colliding_file_names(self):
+        metadata.db_export_metadefs(self.engine, self.export_dir,
+                                    archive=True)
+
+        with tarfile.open(os.path.join(self.export_dir,
+                                       'metadefs.tar.gz')) as tar:
+            names = tar.getnames()
+            documents = dict((name, json.load(tar.extractfile(name)))
+                             for name in names)
+        self.assertEqual(len(names), len(set(names)))
+        self._assert_documents(documents)
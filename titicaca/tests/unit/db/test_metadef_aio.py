@@ -0,0 +1,92 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+import unittest
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+from titicaca.common import exception
+from titicaca.db.sqlalchemy.metadef_api import aio
+from titicaca.db.sqlalchemy.metadef_api import namespace as namespace_api
+from titicaca.db.sqlalchemy.metadef_api import tag as tag_api
+from titicaca.tests import utils as test_utils
+
+
+@unittest.skipUnless(aiosqlite, 'aiosqlite is not installed')
+class TestMetadefAsyncAPI(test_utils.MetadefDBTestCase,
+                          unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        super(TestMetadefAsyncAPI, self).setUp()
+        self.config(group='database', connection=self.db_url)
+        self.admin = test_utils.get_context(is_admin=True)
+        self.owner = test_utils.get_context(owner='tenant1')
+        self.other = test_utils.get_context(owner='tenant2')
+
+        session = self.get_session()
+        for name, visibility in (('public_ns', 'public'),
+                                 ('private_ns', 'private')):
+            namespace_api.create(self.admin,
+                                 {'namespace': name, 'owner': 'tenant1',
+                                  'visibility': visibility,
+                                  'protected': False},
+                                 session)
+        tag_api.create(self.admin, 'private_ns', {'name': 'tag1'}, session)
+        session.commit()
+
+    async def asyncTearDown(self):
+        await aio.dispose()
+        await super(TestMetadefAsyncAPI, self).asyncTearDown()
+
+    def test_get_async_url(self):
+        self.assertEqual('sqlite+aiosqlite:///x.db',
+                         str(aio.get_async_url('sqlite:///x.db')))
+        self.assertEqual('mysql+aiomysql://u:p@h/titicaca',
+                         aio.get_async_url('mysql+pymysql://u:p@h/titicaca')
+                         .render_as_string(hide_password=False))
+        self.assertRaises(exception.Invalid, aio.get_async_url,
+                          'oracle://u:p@h/titicaca')
+
+    async def test_namespace_get(self):
+        async with aio.get_session() as session:
+            for context in (self.admin, self.owner, self.other):
+                namespace = await aio.namespace_get(context, 'public_ns',
+                                                    session)
+                self.assertEqual('public_ns', namespace['namespace'])
+                self.assertEqual('tenant1', namespace['owner'])
+
+            namespace = await aio.namespace_get(self.owner, 'private_ns',
+                                                session)
+        self.assertEqual('private', namespace['visibility'])
+
+    async def test_namespace_get_not_found(self):
+        async with aio.get_session() as session:
+            with self.assertRaises(exception.MetadefNamespaceNotFound):
+                await aio.namespace_get(self.admin, 'missing_ns', session)
+
+    async def test_namespace_get_forbidden(self):
+        async with aio.get_session() as session:
+            with self.assertRaises(exception.MetadefForbidden):
+                await aio.namespace_get(self.other, 'private_ns', session)
+
+    async def test_namespace_get_all_visibility(self):
+        async with aio.get_session() as session:
+            admin_names = [ns['namespace'] for ns in
+                           await aio.namespace_get_all(self.admin, session)]
+            other_names = [ns['namespace'] for ns in
+                           await aio.namespace_get_all(self.other, session)]
+        self.assertEqual(['private_ns', 'public_ns'], sorted(admin_names))
+        self.assertEqual(['public_ns'], other_names)
+
+    async def test_tag_get(self):
+        async with aio.get_session() as session:
+            tag = await aio.tag_get(self.owner, 'private_ns', 'tag1',
+                                    session)
+            self.assertEqual('tag1', tag['name'])
+            with self.assertRaises(exception.MetadefTagNotFound):
+                await aio.tag_get(self.owner, 'private_ns', 'tag2', session)
+            with self.assertRaises(exception.MetadefForbidden):
+                await aio.tag_get(self.other, 'private_ns', 'tag1', session)
@@ -0,0 +1,103 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+from titicaca.db.sqlalchemy.metadef_api import namespace as namespace_api
+from titicaca.db.sqlalchemy.metadef_api import (
+    resource_type_association as rta_api)
+from titicaca.db.sqlalchemy.metadef_api import utils as metadef_utils
+from titicaca.tests import utils as test_utils
+
+
+class TestNamespaceGetAllByResourceTypes(test_utils.MetadefDBTestCase):
+
+    def setUp(self):
+        super(TestNamespaceGetAllByResourceTypes, self).setUp()
+        self.admin = test_utils.get_context(is_admin=True)
+        self.owner = test_utils.get_context(owner='tenant1')
+        self.other = test_utils.get_context(owner='tenant2')
+        self.session = self.get_session()
+
+        # name: (visibility, associated resource types)
+        namespaces = {
+            'ns1': ('public', ['OS::Glance::Image']),
+            'ns2': ('private', ['OS::Glance::Image']),
+            'ns3': ('public', ['OS::Cinder::Volume']),
+            'ns4': ('public', ['OS::Glance::Image', 'OS::Cinder::Volume']),
+            'ns5': ('private', ['OS::Cinder::Volume']),
+            'ns6': ('public', []),
+        }
+        for name, (visibility, resource_types) in sorted(namespaces.items()):
+            namespace_api.create(self.admin,
+                                 {'namespace': name, 'owner': 'tenant1',
+                                  'visibility': visibility,
+                                  'protected': False},
+                                 self.session)
+            for resource_type in resource_types:
+                rta_api.create(self.admin, name,
+                               {'name': resource_type,
+                                'properties_target': None, 'prefix': None},
+                               self.session)
+        self.session.commit()
+
+    def _get_names(self, context, filters, **kwargs):
+        return [ns['namespace'] for ns in
+                namespace_api.get_all(context, self.session,
+                                      filters=dict(filters),
+                                      sort_key='namespace', sort_dir='asc',
+                                      **kwargs)]
+
+    def test_visibility(self):
+        filters = {'resource_types': 'OS::Glance::Image'}
+        self.assertEqual(['ns1', 'ns2', 'ns4'],
+                         self._get_names(self.admin, filters))
+        self.assertEqual(['ns1', 'ns2', 'ns4'],
+                         self._get_names(self.owner, filters))
+        self.assertEqual(['ns1', 'ns4'],
+                         self._get_names(self.other, filters))
+
+    def test_several_resource_types(self):
+        filters = {'resource_types': 'OS::Glance::Image,OS::Cinder::Volume'}
+        # ns4 is associated with both and listed once
+        self.assertEqual(['ns1', 'ns2', 'ns3', 'ns4', 'ns5'],
+                         self._get_names(self.admin, filters))
+        self.assertEqual(['ns1', 'ns3', 'ns4'],
+                         self._get_names(self.other, filters))
+
+    def test_visibility_filter(self):
+        filters = {'resource_types': 'OS::Cinder::Volume',
+                   'visibility': 'private'}
+        self.assertEqual(['ns5'], self._get_names(self.owner, filters))
+        self.assertEqual([], self._get_names(self.other, filters))
+
+    def test_unknown_resource_type(self):
+        self.assertEqual([], self._get_names(
+            self.admin, {'resource_types': 'OS::Nova::Server'}))
+
+    def _get_pages(self, context, filters, limit):
+        pages = []
+        marker = None
+        while True:
+            page = namespace_api.get_all(context, self.session,
+                                         filters=dict(filters), limit=limit,
+                                         marker=marker, sort_key='namespace',
+                                         sort_dir='asc')
+            if not page:
+                return pages
+            pages.append([ns['namespace'] for ns in page])
+            marker = metadef_utils.make_cursor(page[-1], 'namespace', 'asc')
+
+    def test_marker(self):
+        filters = {'resource_types': 'OS::Glance::Image,OS::Cinder::Volume'}
+        self.assertEqual([['ns1', 'ns2'], ['ns3', 'ns4'], ['ns5']],
+                         self._get_pages(self.admin, filters, 2))
+        self.assertEqual([['ns1', 'ns3'], ['ns4']],
+                         self._get_pages(self.other, filters, 2))
+
+    def test_marker_namespace_id(self):
+        filters = {'resource_types': 'OS::Glance::Image'}
+        first = namespace_api.get_all(self.other, self.session,
+                                      filters=dict(filters), limit=1,
+                                      sort_key='namespace', sort_dir='asc')
+        self.assertEqual(['ns1'], [ns['namespace'] for ns in first])
+        self.assertEqual(['ns4'], self._get_names(self.other, filters,
+                                                  marker=first[0]['id']))
@@ -0,0 +1,77 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+from unittest import mock
+
+from titicaca.db.sqlalchemy.metadef_api import namespace as namespace_api
+from titicaca.db.sqlalchemy.metadef_api import object as object_api
+from titicaca.db.sqlalchemy.metadef_api import property as property_api
+from titicaca.db.sqlalchemy.metadef_api import utils as metadef_utils
+from titicaca.db.sqlalchemy import models
+from titicaca.tests import utils as test_utils
+
+
+class TestGetAllFields(test_utils.MetadefDBTestCase):
+
+    def setUp(self):
+        super(TestGetAllFields, self).setUp()
+        self.context = test_utils.get_context(is_admin=True)
+        self.session = self.get_session()
+        namespace_api.create(self.context,
+                             {'namespace': 'ns', 'owner': 'admin',
+                              'visibility': 'public', 'protected': False},
+                             self.session)
+        schema = {'type': 'string', 'enum': ['a', 'b']}
+        for name in ('prop1', 'prop2', 'prop3'):
+            property_api.create(self.context, 'ns',
+                                {'name': name, 'json_schema': schema},
+                                self.session)
+            object_api.create(self.context, 'ns',
+                              {'name': name, 'json_schema': schema,
+                               'description': None},
+                              self.session)
+        self.session.commit()
+
+    def _assert_not_decoded(self, api, **kwargs):
+        with mock.patch.object(models.JSONEncodedDict,
+                               'process_result_value') as mock_decode:
+            records = api.get_all(self.context, 'ns', self.session,
+                                  fields=['name'], **kwargs)
+        mock_decode.assert_not_called()
+        for record in records:
+            self.assertEqual({'id', 'name', 'created_at'}, set(record))
+        return records
+
+    def test_property_names(self):
+        records = self._assert_not_decoded(property_api, sort_key='name',
+                                           sort_dir='asc')
+        self.assertEqual(['prop1', 'prop2', 'prop3'],
+                         [record['name'] for record in records])
+
+    def test_object_names(self):
+        records = self._assert_not_decoded(object_api, sort_key='name',
+                                           sort_dir='asc')
+        self.assertEqual(['prop1', 'prop2', 'prop3'],
+                         [record['name'] for record in records])
+
+    def test_names_marker(self):
+        first = property_api.get_all(self.context, 'ns', self.session,
+                                     limit=2, sort_key='name',
+                                     sort_dir='asc', fields=['name'])
+        self.assertEqual(['prop1', 'prop2'],
+                         [record['name'] for record in first])
+        self.assertNotIn('json_schema', first[0])
+        marker = metadef_utils.make_cursor(first[-1], 'name', 'asc')
+        second = property_api.get_all(self.context, 'ns', self.session,
+                                      marker=marker, limit=2,
+                                      sort_key='name', sort_dir='asc',
+                                      fields=['name'])
+        self.assertEqual(['prop3'], [record['name'] for record in second])
+
+    def test_all_fields(self):
+        records = property_api.get_all(self.context, 'ns', self.session)
+        self.assertEqual({'type': 'string', 'enum': ['a', 'b']},
+                         records[0]['json_schema'])
+        self.assertEqual(property_api.get(self.context, 'ns',
+                                          records[0]['name'], self.session),
+                         records[0])
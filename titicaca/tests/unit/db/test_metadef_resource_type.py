@@ -0,0 +1,153 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+import datetime
+from unittest import mock
+
+from titicaca.common import exception
+from titicaca.db.sqlalchemy.metadef_api import cache as metadef_cache
+from titicaca.db.sqlalchemy.metadef_api import namespace as namespace_api
+from titicaca.db.sqlalchemy.metadef_api import resource_type as rt_api
+from titicaca.db.sqlalchemy.metadef_api import (
+    resource_type_association as rta_api)
+from titicaca.db.sqlalchemy import models_metadef as models
+from titicaca.tests import utils as test_utils
+
+
+class TestResourceTypeCache(test_utils.BaseTestCase):
+
+    def test_get_within_probe_interval(self):
+        self.config(metadef_resource_type_cache_probe_interval=60)
+        cache = metadef_cache.ResourceTypeCache()
+        self.assertIsNone(cache.get())
+
+        cache.put((1,), {'a': {'name': 'a'}})
+        self.assertEqual({'a': {'name': 'a'}}, cache.get())
+
+    def test_get_after_probe_interval(self):
+        self.config(metadef_resource_type_cache_probe_interval=0)
+        cache = metadef_cache.ResourceTypeCache()
+        cache.put((1,), {'a': {'name': 'a'}})
+        self.assertIsNone(cache.get())
+
+    def test_get_if_version(self):
+        self.config(metadef_resource_type_cache_probe_interval=0)
+        cache = metadef_cache.ResourceTypeCache()
+        cache.put((1,), {'a': {'name': 'a'}})
+        self.assertIsNone(cache.get_if_version((2,)))
+        self.assertEqual({'a': {'name': 'a'}}, cache.get_if_version((1,)))
+        self.assertEqual({'hits': 1, 'misses': 1, 'entries': 1},
+                         cache.stats())
+
+    def test_invalidate(self):
+        self.config(metadef_resource_type_cache_probe_interval=60)
+        cache = metadef_cache.ResourceTypeCache()
+        cache.put((1,), {'a': {'name': 'a'}})
+        cache.invalidate()
+        self.assertIsNone(cache.get())
+        self.assertIsNone(cache.get_if_version((1,)))
+
+
+class TestResourceTypeAPI(test_utils.MetadefDBTestCase):
+
+    def setUp(self):
+        super(TestResourceTypeAPI, self).setUp()
+        # Long enough for the cache not to be probed during a test
+        self.config(metadef_resource_type_cache_probe_interval=3600)
+        self.context = test_utils.get_context(is_admin=True)
+        self.session = self.get_session()
+
+    def _create_in_other_worker(self, name):
+        """Insert a resource type without going through this process."""
+        # NOTE: sqlite locks the whole database, end the reads of the
+        # test session first.
+        self.session.commit()
+        session = self.get_session()
+        session.add(models.MetadefResourceType(name=name, protected=False))
+        session.commit()
+
+    def test_get_all_is_cached(self):
+        rt_api.create(self.context, {'name': 'OS::A'}, self.session)
+        self.session.commit()
+
+        self.assertEqual(['OS::A'], [rt['name'] for rt in
+                                     rt_api.get_all(self.context,
+                                                    self.session)])
+        with mock.patch.object(rt_api, '_get_version') as mock_version:
+            rt_api.get(self.context, 'OS::A', self.session)
+            rt_api.get_all(self.context, self.session)
+        mock_version.assert_not_called()
+
+    def test_get_created_by_other_worker(self):
+        rt_api.get_all(self.context, self.session)
+        self._create_in_other_worker('OS::B')
+
+        resource_type = rt_api.get(self.context, 'OS::B', self.session)
+        self.assertEqual('OS::B', resource_type['name'])
+        self.assertIn('OS::B', [rt['name'] for rt in
+                                rt_api.get_all(self.context, self.session)])
+
+    def test_get_not_found(self):
+        rt_api.get_all(self.context, self.session)
+        self.assertRaises(exception.MetadefResourceTypeNotFound,
+                          rt_api.get, self.context, 'OS::Missing',
+                          self.session)
+
+    def test_association_with_type_created_by_other_worker(self):
+        namespace_api.create(self.context,
+                             {'namespace': 'ns', 'owner': 'admin',
+                              'visibility': 'public', 'protected': False},
+                             self.session)
+        self.session.commit()
+        rt_api.get_all(self.context, self.session)
+        self._create_in_other_worker('OS::C')
+
+        association = rta_api.create(
+            self.context, 'ns',
+            {'name': 'OS::C', 'properties_target': None, 'prefix': 'c_'},
+            self.session)
+        self.session.commit()
+        self.assertEqual('OS::C', association['name'])
+
+    def test_association_create_race(self):
+        namespace_api.create(self.context,
+                             {'namespace': 'ns', 'owner': 'admin',
+                              'visibility': 'public', 'protected': False},
+                             self.session)
+        self.session.commit()
+        get = rt_api.get
+
+        def get_then_create(context, name, session):
+            # The type shows up between the lookup and the creation
+            try:
+                return get(context, name, session)
+            finally:
+                if mock_get.call_count == 1:
+                    self._create_in_other_worker(name)
+
+        with mock.patch.object(rt_api, 'get',
+                               side_effect=get_then_create) as mock_get:
+            association = rta_api.create(
+                self.context, 'ns',
+                {'name': 'OS::D', 'properties_target': None, 'prefix': None},
+                self.session)
+        self.session.commit()
+        self.assertEqual('OS::D', association['name'])
+        self.assertEqual(2, mock_get.call_count)
+
+    def test_version_changes_on_delete_and_create(self):
+        created_at = datetime.datetime(2023, 1, 1)
+        self.session.add_all([
+            models.MetadefResourceType(name=name, protected=False,
+                                       created_at=created_at,
+                                       updated_at=created_at)
+            for name in ('OS::E', 'OS::F')])
+        self.session.commit()
+        version = rt_api._get_version(self.session)
+
+        rt_api.delete(self.context, 'OS::E', self.session)
+        self.session.add(models.MetadefResourceType(
+            name='OS::G', protected=False, created_at=created_at,
+            updated_at=created_at))
+        self.session.commit()
+        self.assertNotEqual(version, rt_api._get_version(self.session))
@@ -0,0 +1,60 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+import sqlalchemy as sa
+
+from titicaca.db.sqlalchemy.metadef_api import namespace as namespace_api
+from titicaca.db.sqlalchemy.metadef_api import tag as tag_api
+from titicaca.tests import utils as test_utils
+
+
+class TestTagLookupStatementCache(test_utils.MetadefDBTestCase):
+
+    def setUp(self):
+        super(TestTagLookupStatementCache, self).setUp()
+        self.context = test_utils.get_context(is_admin=True)
+        self.session = self.get_session()
+        for namespace in ('ns1', 'ns2'):
+            namespace_api.create(self.context,
+                                 {'namespace': namespace, 'owner': 'admin',
+                                  'visibility': 'public',
+                                  'protected': False},
+                                 self.session)
+            for name in ('tag1', 'tag2'):
+                tag_api.create(self.context, namespace, {'name': name},
+                               self.session)
+        self.session.commit()
+
+        self.cache_stats = []
+        sa.event.listen(self.engine, 'after_cursor_execute',
+                        self._record_cache_stats)
+        self.addCleanup(sa.event.remove, self.engine,
+                        'after_cursor_execute', self._record_cache_stats)
+
+    def _record_cache_stats(self, conn, cursor, statement, parameters,
+                            context, executemany):
+        self.cache_stats.append(context.cache_hit)
+
+    def _lookups(self):
+        for namespace in ('ns1', 'ns2'):
+            for name in ('tag1', 'tag2'):
+                tag = tag_api._get_by_name(self.context, namespace, name,
+                                           self.session)
+                self.assertEqual(name, tag.name)
+            self.assertEqual(2, tag_api.count(self.context, namespace,
+                                              self.session))
+
+    def test_repeated_lookups_hit_compiled_cache(self):
+        # The first round compiles, and caches the namespace refs
+        self._lookups()
+        cache_size = len(self.engine._compiled_cache)
+        del self.cache_stats[:]
+
+        for i in range(10):
+            self._lookups()
+
+        # One statement per tag lookup and count, whatever the values
+        self.assertEqual(60, len(self.cache_stats))
+        self.assertEqual(
+            {self.engine.dialect.CACHE_HIT}, set(self.cache_stats))
+        self.assertEqual(cache_size, len(self.engine._compiled_cache))
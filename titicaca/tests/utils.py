@@ -0,0 +1,68 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+"""Common utilities used in testing"""
+
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+from oslo_config import cfg
+from oslo_db.sqlalchemy import engines
+import sqlalchemy.orm as sa_orm
+
+from titicaca.db.sqlalchemy.metadef_api import cache as metadef_cache
+from titicaca.db.sqlalchemy import models_metadef
+
+CONF = cfg.CONF
+
+
+def get_context(owner=None, is_admin=False):
+    """Return a request context stand-in for the metadef API calls."""
+    return types.SimpleNamespace(owner=owner, is_admin=is_admin)
+
+
+class BaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(BaseTestCase, self).setUp()
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir, True)
+
+    def config(self, group=None, **kw):
+        """Override some configuration values, undone at cleanup."""
+        for name, value in kw.items():
+            CONF.set_override(name, value, group)
+            self.addCleanup(CONF.clear_override, name, group)
+
+
+class MetadefDBTestCase(BaseTestCase):
+    """Test case with the metadef tables in a file based sqlite database.
+
+    The process wide metadef caches are emptied before and after each
+    test.
+    """
+
+    def setUp(self):
+        super(MetadefDBTestCase, self).setUp()
+        self.db_url = 'sqlite:///%s' % os.path.join(self.test_dir,
+                                                    'titicaca.sqlite')
+        self.engine = engines.create_engine(self.db_url)
+        self.addCleanup(self.engine.dispose)
+        models_metadef.register_models(self.engine)
+
+        self._clear_caches()
+        self.addCleanup(self._clear_caches)
+
+    @staticmethod
+    def _clear_caches():
+        metadef_cache.get_namespace_cache().clear()
+        metadef_cache.get_resource_type_cache().invalidate()
+
+    def get_session(self):
+        """Return a new session, closed at cleanup."""
+        session = sa_orm.Session(self.engine)
+        self.addCleanup(session.close)
+        return session
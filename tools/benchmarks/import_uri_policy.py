@@ -0,0 +1,97 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+"""
+Micro-benchmark of validate_import_uri
+
+Compares the compiled import uri policy with the previous function,
+which read the six import_filtering_opts lists from CONF and scanned
+them on every call, over the same uris and options::
+
+    python tools/benchmarks/import_uri_policy.py [--number N]
+"""
+
+import argparse
+import timeit
+import urllib
+
+from oslo_config import cfg
+
+from titicaca.common import utils
+
+CONF = cfg.CONF
+
+URIS = ['http://example.com/image.qcow2',
+        'https://mirror.example.org:8443/cloud/image.raw',
+        'ftp://10.0.0.5/image',
+        'http://203.0.113.9:8080/image']
+
+
+def legacy_validate_import_uri(uri):
+    if not uri:
+        return False
+
+    parsed_uri = urllib.parse.urlparse(uri)
+    scheme = parsed_uri.scheme
+    host = parsed_uri.hostname
+    port = parsed_uri.port
+    wl_schemes = CONF.import_filtering_opts.allowed_schemes
+    bl_schemes = CONF.import_filtering_opts.disallowed_schemes
+    wl_hosts = CONF.import_filtering_opts.allowed_hosts
+    bl_hosts = CONF.import_filtering_opts.disallowed_hosts
+    wl_ports = CONF.import_filtering_opts.allowed_ports
+    bl_ports = CONF.import_filtering_opts.disallowed_ports
+
+    if wl_schemes and bl_schemes:
+        bl_schemes = []
+    if wl_hosts and bl_hosts:
+        bl_hosts = []
+    if wl_ports and bl_ports:
+        bl_ports = []
+
+    if not scheme or ((wl_schemes and scheme not in wl_schemes) or
+                      parsed_uri.scheme in bl_schemes):
+        return False
+    if not host or ((wl_hosts and host not in wl_hosts) or
+                    host in bl_hosts):
+        return False
+    if port and ((wl_ports and port not in wl_ports) or
+                 port in bl_ports):
+        return False
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=20000,
+                        help='Calls per uri and function')
+    args = parser.parse_args()
+
+    CONF([], project='titicaca')
+    CONF.set_override('allowed_schemes', ['http', 'https'],
+                      'import_filtering_opts')
+    CONF.set_override('disallowed_hosts',
+                      ['10.0.0.5', '192.168.0.1', 'localhost', 'internal',
+                       'metadata.internal', '127.0.0.1'],
+                      'import_filtering_opts')
+    CONF.set_override('allowed_ports', [80, 443, 8443],
+                      'import_filtering_opts')
+    utils.reset_import_uri_policy()
+
+    for uri in URIS:
+        assert legacy_validate_import_uri(uri) == \
+            utils.validate_import_uri(uri), uri
+
+    for name, func in (('legacy', legacy_validate_import_uri),
+                       ('compiled', utils.validate_import_uri)):
+        elapsed = min(timeit.repeat(
+            lambda: [func(uri) for uri in URIS],
+            number=args.number, repeat=3))
+        calls = args.number * len(URIS)
+        print('%-8s %8.3fs for %d calls, %6.2f us/call'
+              % (name, elapsed, calls, elapsed / calls * 1e6))
+
+
+if __name__ == '__main__':
+    main()
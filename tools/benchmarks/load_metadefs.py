@@ -0,0 +1,79 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+"""
+Benchmark of db_load_metadefs
+
+Times loading the metadata definition files into an empty sqlite
+database, then merging them again over the loaded rows, as
+titicaca-manage db load_metadefs does. Each case runs with the tables
+reflected once per MetaData, and with the previous helpers that built
+the reflected Table again on every call::
+
+    python tools/benchmarks/load_metadefs.py [--path etc/metadefs]
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from unittest import mock
+
+import sqlalchemy as sa
+
+from titicaca.db.sqlalchemy import metadata
+from titicaca.db.sqlalchemy import models_metadef as models
+
+CASES = [
+    ('load', {}),
+    ('merge', {'merge': True}),
+    ('merge prefer_new', {'merge': True, 'prefer_new': True}),
+    ('merge overwrite', {'merge': True, 'overwrite': True}),
+]
+
+
+def legacy_get_table(meta, name):
+    return sa.Table(name, meta, autoload_with=meta.bind)
+
+
+def run(engine, path, repeat):
+    timings = dict((name, []) for name, kwargs in CASES)
+    for i in range(repeat):
+        models.unregister_models(engine)
+        models.register_models(engine)
+        for name, kwargs in CASES:
+            start = time.perf_counter()
+            metadata.db_load_metadefs(engine, path, **kwargs)
+            timings[name].append(time.perf_counter() - start)
+    return dict((name, min(times)) for name, times in timings.items())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default='etc/metadefs',
+                        help='Directory of the metadata definition files')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs of each case, the best is kept')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        engine = sa.create_engine(
+            'sqlite:///%s' % os.path.join(test_dir, 'titicaca.sqlite'))
+        with mock.patch.object(metadata, '_get_table',
+                               side_effect=legacy_get_table) as get_table:
+            per_call = run(engine, args.path, args.repeat)
+        cached = run(engine, args.path, args.repeat)
+        engine.dispose()
+
+    print('%d table lookups per round' % (get_table.call_count //
+                                          args.repeat))
+    print('%-17s %10s %10s' % ('', 'per-call', 'cached'))
+    for name, kwargs in CASES:
+        print('%-17s %7.1f ms %7.1f ms'
+              % (name, per_call[name] * 1e3, cached[name] * 1e3))
+
+
+if __name__ == '__main__':
+    main()
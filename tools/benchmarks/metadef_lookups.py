@@ -0,0 +1,104 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+"""
+Benchmark of the hot metadef tag lookups
+
+Compares the lambda_stmt() tag lookup by name and tag count with the
+previous Query based ones, which built a new Query and computed its
+cache key on every call. Reports the per-call latency and how many
+executions hit the engine's compiled statement cache::
+
+    python tools/benchmarks/metadef_lookups.py [--number N]
+"""
+
+import argparse
+import os
+import tempfile
+import timeit
+import types
+
+from oslo_db.sqlalchemy import engines
+import sqlalchemy as sa
+from sqlalchemy import func
+import sqlalchemy.orm as sa_orm
+
+from titicaca.db.sqlalchemy.metadef_api import namespace as namespace_api
+from titicaca.db.sqlalchemy.metadef_api import tag as tag_api
+from titicaca.db.sqlalchemy import models_metadef as models
+
+NAMESPACES = ['ns%d' % i for i in range(4)]
+TAGS = ['tag%d' % i for i in range(8)]
+
+
+def legacy_get_by_name(context, namespace_name, name, session):
+    namespace = namespace_api.get_ref(context, namespace_name, session)
+    query = (session.query(models.MetadefTag).filter_by(
+        name=name, namespace_id=namespace['id']))
+    return query.one()
+
+
+def legacy_count(context, namespace_name, session):
+    namespace = namespace_api.get_ref(context, namespace_name, session)
+    query = (session.query(func.count(models.MetadefTag.id)).filter_by(
+        namespace_id=namespace['id']))
+    return query.scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=200,
+                        help='Rounds over every namespace and tag')
+    args = parser.parse_args()
+
+    context = types.SimpleNamespace(owner=None, is_admin=True)
+    with tempfile.TemporaryDirectory() as test_dir:
+        engine = engines.create_engine(
+            'sqlite:///%s' % os.path.join(test_dir, 'titicaca.sqlite'))
+        models.register_models(engine)
+        cache_stats = []
+
+        @sa.event.listens_for(engine, 'after_cursor_execute')
+        def record_cache_stats(conn, cursor, statement, parameters,
+                               context, executemany):
+            cache_stats.append(context.cache_hit)
+
+        with sa_orm.Session(engine) as session:
+            for namespace in NAMESPACES:
+                namespace_api.create(context,
+                                     {'namespace': namespace,
+                                      'owner': 'admin',
+                                      'visibility': 'public',
+                                      'protected': False},
+                                     session)
+                for name in TAGS:
+                    tag_api.create(context, namespace, {'name': name},
+                                   session)
+            session.commit()
+
+            for label, get_by_name, count in (
+                    ('query', legacy_get_by_name, legacy_count),
+                    ('lambda', tag_api._get_by_name, tag_api.count)):
+                def lookups():
+                    for namespace in NAMESPACES:
+                        for name in TAGS:
+                            get_by_name(context, namespace, name, session)
+                        count(context, namespace, session)
+
+                cache_size = len(engine._compiled_cache)
+                lookups()
+                del cache_stats[:]
+                elapsed = min(timeit.repeat(lookups, number=args.number,
+                                            repeat=3))
+                calls = args.number * len(NAMESPACES) * (len(TAGS) + 1)
+                hits = cache_stats.count(engine.dialect.CACHE_HIT)
+                print('%-6s %6.2f us/call, compiled cache hits %d/%d, '
+                      '%d statements compiled'
+                      % (label, elapsed / calls * 1e6, hits,
+                         len(cache_stats),
+                         len(engine._compiled_cache) - cache_size))
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# Copyright (c) 2023 WenRui Gong
+# All rights reserved.
+
+"""
+Benchmark of the namespace listing filtered by resource types
+
+Compares the EXISTS semi-join of namespace.get_all with the previous
+two step lookup, which loaded the ids of every associated namespace
+and sent them back as an IN list, on a sqlite database holding
+--namespaces namespaces::
+
+    python tools/benchmarks/namespace_resource_types.py [--namespaces N]
+"""
+
+import argparse
+import datetime
+import os
+import tempfile
+import timeit
+import types
+
+from oslo_db.sqlalchemy import engines
+import sqlalchemy as sa
+import sqlalchemy.orm as sa_orm
+
+from titicaca.db.sqlalchemy.metadef_api import namespace as namespace_api
+from titicaca.db.sqlalchemy import models_metadef as models
+
+RESOURCE_TYPES = ['OS::Glance::Image', 'OS::Cinder::Volume',
+                  'OS::Nova::Server', 'OS::Nova::Flavor']
+
+
+def legacy_get_all(context, session, filters, marker=None, limit=None,
+                   sort_key=None, sort_dir=None):
+    resource_type_list = filters['resource_types'].split(',')
+    db_recs = (
+        session.query(models.MetadefResourceType)
+        .join(models.MetadefResourceType.associations)
+        .filter(models.MetadefResourceType.name.in_(resource_type_list))
+        .with_entities(models.MetadefResourceType.name,
+                       models.MetadefNamespaceResourceType.namespace_id))
+
+    namespace_id_list = [namespace_id for name, namespace_id in db_recs]
+    if not namespace_id_list:
+        return []
+
+    filters = dict(filters, id_list=namespace_id_list)
+    del filters['resource_types']
+    return models.MetadefNamespace.rows_to_dicts(namespace_api._get_all(
+        context, session, filters, marker, limit, sort_key, sort_dir))
+
+
+def populate(engine, count):
+    now = datetime.datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(sa.insert(models.MetadefResourceType.__table__), [
+            {'id': i + 1, 'name': name, 'protected': False,
+             'created_at': now}
+            for i, name in enumerate(RESOURCE_TYPES)])
+        conn.execute(sa.insert(models.MetadefNamespace.__table__), [
+            {'id': i, 'namespace': 'ns%05d' % i,
+             'visibility': 'public' if i % 2 else 'private',
+             'protected': False, 'owner': 'tenant%d' % (i % 50),
+             'created_at': now + datetime.timedelta(seconds=i)}
+            for i in range(1, count + 1)])
+        # Each namespace goes with one resource type
+        conn.execute(
+            sa.insert(models.MetadefNamespaceResourceType.__table__), [
+                {'namespace_id': i,
+                 'resource_type_id': i % len(RESOURCE_TYPES) + 1,
+                 'created_at': now}
+                for i in range(1, count + 1)])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--namespaces', type=int, default=10000,
+                        help='Number of namespaces in the database')
+    parser.add_argument('--number', type=int, default=20,
+                        help='Calls per case and function')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        engine = engines.create_engine(
+            'sqlite:///%s' % os.path.join(test_dir, 'titicaca.sqlite'))
+        models.register_models(engine)
+        populate(engine, args.namespaces)
+
+        cases = [
+            ('admin, 1 type, all', types.SimpleNamespace(
+                owner=None, is_admin=True),
+             'OS::Glance::Image', None),
+            ('admin, 2 types, limit 20', types.SimpleNamespace(
+                owner=None, is_admin=True),
+             'OS::Glance::Image,OS::Nova::Server', 20),
+            ('tenant, 1 type, limit 20', types.SimpleNamespace(
+                owner='tenant7', is_admin=False),
+             'OS::Cinder::Volume', 20),
+        ]
+        with sa_orm.Session(engine) as session:
+            for label, context, resource_types, limit in cases:
+                filters = {'resource_types': resource_types}
+                results = {}
+                for name, func in (('in-list', legacy_get_all),
+                                   ('exists', namespace_api.get_all)):
+                    def call():
+                        return func(context, session, filters=dict(filters),
+                                    limit=limit)
+
+                    results[name] = [ns['id'] for ns in call()]
+                    elapsed = min(timeit.repeat(call, number=args.number,
+                                                repeat=3))
+                    print('%-26s %-8s %5d rows %8.2f ms/call'
+                          % (label, name, len(results[name]),
+                             elapsed / args.number * 1e3))
+                assert results['in-list'] == results['exists'], label
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()